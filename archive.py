@@ -0,0 +1,109 @@
+"""Перенос старых завершённых заданий в архив.
+
+Раз в interval секунд задания со статусом 'completed', завершённые
+больше after_days дней назад, пачками переносятся из tasks в
+tasks_archive: INSERT ... SELECT и DELETE в одной короткой транзакции.
+Неоценённое задание студент может оценить только из «Моих заданий»,
+поэтому такие задания ждут дольше — unrated_after_days.
+Так таблица tasks и её индексы растут вместе с текущей работой, а не со
+всей историей. Архив показывается по кнопке «📦 Архив», а сводки
+преподавателей и рейтинги помощников его учитывают.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, or_, exists
+from database import AsyncSession, Task, ArchivedTask
+
+logger = logging.getLogger(__name__)
+
+# Колонки, которые переносятся из tasks в tasks_archive
+ARCHIVED_COLUMNS = [column.name for column in Task.__table__.columns]
+
+
+async def archive_completed(session, before, limit, unrated_before=None):
+    """Переносит до limit заданий, завершённых раньше before. Возвращает их число.
+
+    Неоценённые задания переносятся, только если завершены раньше unrated_before.
+    """
+    # У заданий, завершённых до появления completed_at, берём время последнего изменения
+    finished = func.coalesce(Task.completed_at, Task.updated_at, Task.created_at)
+    rated = Task.rating.isnot(None)
+    if unrated_before is not None:
+        rated = or_(rated, finished < unrated_before)
+    ids = (await session.scalars(
+        select(Task.id)
+            .where(
+                Task.status == 'completed', finished < before, rated,
+                # id, выданный повторно до AUTOINCREMENT (миграция 10), уже занят в архиве
+                ~exists().where(ArchivedTask.id == Task.id),
+            )
+            .order_by(Task.id)
+            .limit(limit)
+    )).all()
+    if not ids:
+        return 0
+    tasks = Task.__table__
+    await session.execute(
+        insert(ArchivedTask.__table__).from_select(
+            ARCHIVED_COLUMNS,
+            select(*(tasks.c[name] for name in ARCHIVED_COLUMNS)).where(tasks.c.id.in_(ids))
+        )
+    )
+    await session.execute(delete(tasks).where(tasks.c.id.in_(ids)))
+    return len(ids)
+
+
+class TaskArchiver:
+    def __init__(self, interval=3600, after_days=90, unrated_after_days=365, batch_size=500):
+        self.interval = interval
+        self.after_days = after_days
+        self.unrated_after_days = unrated_after_days
+        self.batch_size = batch_size
+        self._task = None
+
+    def start(self):
+        if self.after_days:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Ошибка архивации заданий")
+            await asyncio.sleep(self.interval)
+
+    async def tick(self, now=None):
+        """Один проход: переносит все подходящие задания пачками по batch_size."""
+        now = now or datetime.now()
+        before = now - timedelta(days=self.after_days)
+        unrated_before = now - timedelta(days=max(self.after_days, self.unrated_after_days))
+        archived = 0
+        while True:
+            async with AsyncSession() as session:
+                moved = await archive_completed(session, before, self.batch_size, unrated_before)
+                await session.commit()
+            archived += moved
+            if moved < self.batch_size:
+                break
+            # Между пачками отдаём цикл событий обработчикам бота
+            await asyncio.sleep(0)
+        if archived:
+            logger.info("В архив перенесено заданий: %s", archived)
+        return archived
+
+
+archiver = TaskArchiver(
+    interval=int(os.getenv('ARCHIVE_INTERVAL', 3600)),
+    after_days=int(os.getenv('ARCHIVE_AFTER_DAYS', 90)),
+    unrated_after_days=int(os.getenv('ARCHIVE_UNRATED_AFTER_DAYS', 365)),
+)
@@ -0,0 +1,95 @@
+"""Вложения заданий и решений: разбор сообщений и повторная отправка.
+
+Файлы хранятся в Telegram, в базе — только file_id и метаданные
+(таблица attachments), поэтому повторная отправка ничего не загружает.
+Несколько файлов уходят альбомами через send_media_group, по одному
+запросу на каждые 10 файлов совместимого вида.
+"""
+from collections import namedtuple
+from telegram import InputMediaPhoto, InputMediaDocument, InputMediaVideo, InputMediaAudio
+
+AttachmentInfo = namedtuple('AttachmentInfo', ['media_type', 'file_id', 'file_unique_id', 'file_size', 'file_name'])
+
+# Больше не принимаем: альбом Telegram — до 10 файлов, даём запас на несколько альбомов
+MAX_ATTACHMENTS = 30
+MEDIA_GROUP_LIMIT = 10
+
+# Вид файла -> (метод отправки одного файла, имя параметра, класс для альбома)
+SENDERS = {
+    'photo': ('send_photo', 'photo', InputMediaPhoto),
+    'video': ('send_video', 'video', InputMediaVideo),
+    'document': ('send_document', 'document', InputMediaDocument),
+    'audio': ('send_audio', 'audio', InputMediaAudio),
+}
+
+# В одном альбоме можно смешивать только фото с видео; документы и аудио — отдельно
+ALBUM_KINDS = {'photo': 'visual', 'video': 'visual', 'document': 'document', 'audio': 'audio'}
+
+LABELS = {'photo': 'фото', 'video': 'видео', 'document': 'документ', 'audio': 'аудио'}
+
+
+def from_message(message):
+    """AttachmentInfo для фото, документа, видео или аудио в сообщении, иначе None."""
+    if message.photo:
+        # Telegram присылает несколько размеров, берём самый большой
+        media_type, media, name = 'photo', message.photo[-1], None
+    elif message.document:
+        media_type, media, name = 'document', message.document, message.document.file_name
+    elif message.video:
+        media_type, media, name = 'video', message.video, message.video.file_name
+    elif message.audio:
+        media_type, media, name = 'audio', message.audio, message.audio.file_name
+    else:
+        return None
+    return AttachmentInfo(media_type, media.file_id, media.file_unique_id, media.file_size, name)
+
+
+def collect(items, message):
+    """Добавляет файл из сообщения в список items (без повторов по file_unique_id).
+
+    Возвращает добавленный AttachmentInfo или None, если файла нет, он уже
+    есть в списке или список заполнен.
+    """
+    item = from_message(message)
+    if item is None or len(items) >= MAX_ATTACHMENTS:
+        return None
+    if any(existing.file_unique_id == item.file_unique_id for existing in items):
+        return None
+    items.append(item)
+    return item
+
+
+def delivery_calls(attachments):
+    """Список (метод Bot API, kwargs без chat_id) для отправки вложений.
+
+    Совместимые файлы объединяются в альбомы по MEDIA_GROUP_LIMIT штук,
+    одиночный файл отправляется своим методом.
+    """
+    groups = {}
+    for item in attachments:
+        kind = item.media_type if item.media_type in SENDERS else 'document'
+        groups.setdefault(ALBUM_KINDS[kind], []).append((kind, item))
+
+    calls = []
+    for items in groups.values():
+        for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+            chunk = items[start:start + MEDIA_GROUP_LIMIT]
+            if len(chunk) == 1:
+                kind, item = chunk[0]
+                method, field, _ = SENDERS[kind]
+                calls.append((method, {field: item.file_id}))
+            else:
+                calls.append(('send_media_group', {
+                    'media': [SENDERS[kind][2](media=item.file_id) for kind, item in chunk]
+                }))
+    return calls
+
+
+async def send_attachments(bot, chat_id, attachments):
+    for method, kwargs in delivery_calls(attachments):
+        await getattr(bot, method)(chat_id=chat_id, **kwargs)
+
+
+def describe(attachments):
+    """Короткое описание для карточки: имена документов, для остального — вид файла."""
+    return ", ".join(item.file_name or LABELS.get(item.media_type, 'файл') for item in attachments)
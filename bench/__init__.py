@@ -0,0 +1,8 @@
+"""Офлайн-бенчмарк обработчиков бота.
+
+Настоящие обработчики из handlers.py гоняются через ту же цепочку
+ConversationHandler/CallbackQueryHandler, что и в main.py, а вместо сети
+стоит FakeRequest, мгновенно отвечающий правдоподобным JSON Bot API.
+
+    python -m bench --sizes 1000,10000,50000
+"""
@@ -0,0 +1,87 @@
+"""Запуск бенчмарка: python -m bench [--sizes 1000,10000] [--output bench_output.txt]"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def report(size, bench, race):
+    lines = [f"== {size} tasks =="]
+    lines.append(f"{'scenario':<26}{'updates':>9}{'wall s':>9}{'upd/s':>9}")
+    for name, updates, elapsed in bench.runs:
+        lines.append(f"{name:<26}{updates:>9}{elapsed:>9.2f}{updates / elapsed:>9.0f}")
+    lines.append("")
+    lines.append(f"{'handler':<26}{'n':>7}{'p50 ms':>9}{'p99 ms':>9}{'sql/upd':>9}{'api/upd':>9}")
+    for label, samples in bench.samples.items():
+        seconds = [s for s, _, _ in samples]
+        queries = sum(q for _, q, _ in samples) / len(samples)
+        api = sum(a for _, _, a in samples) / len(samples)
+        lines.append(
+            f"{label:<26}{len(samples):>7}{percentile(seconds, 50) * 1000:>9.1f}"
+            f"{percentile(seconds, 99) * 1000:>9.1f}{queries:>9.1f}{api:>9.1f}"
+        )
+    tasks, single, won, lost = race
+    lines.append("")
+    lines.append(f"choose_task race: {single}/{tasks} contended tasks had exactly one winner "
+                 f"({won} won, {lost} lost)")
+    if bench.errors:
+        lines.append("handler errors: " + ", ".join(f"{k}={v}" for k, v in bench.errors.items()))
+    return "\n".join(lines)
+
+
+async def run_size(args, size):
+    from bench import scenarios
+    scenarios.seed(size, args.helpers)
+    async with scenarios.Bench(args.concurrency) as bench:
+        await scenarios.registration_storm(bench, args.registrations)
+        await scenarios.browsing(bench, args.helpers)
+        await scenarios.searching(bench, args.helpers)
+        await scenarios.inline_browsing(bench, args.helpers)
+        race = await scenarios.choose_race(bench, args.races, args.contenders, args.helpers)
+        await scenarios.solution_burst(bench, args.solutions)
+    return report(size, bench, race), race
+
+
+async def run(args):
+    from database import async_engine
+    try:
+        return [await run_size(args, size) for size in args.sizes]
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the bot handlers")
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        type=lambda text: [int(v) for v in text.split(',')],
+                        help="dataset sizes (number of tasks), comma separated")
+    parser.add_argument('--helpers', type=int, default=1000)
+    parser.add_argument('--registrations', type=int, default=500)
+    parser.add_argument('--races', type=int, default=100, help="tasks contended in the choose_task race")
+    parser.add_argument('--contenders', type=int, default=5, help="helpers per contended task")
+    parser.add_argument('--solutions', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'student_helper_bench.db'))
+    parser.add_argument('--output', help="also write the report to this file")
+    args = parser.parse_args()
+
+    # База выбирается до первого импорта database
+    os.environ['DATABASE_URL'] = f"sqlite:///{args.db}"
+    results = asyncio.run(run(args))
+    text = "\n\n".join(report_text for report_text, _ in results)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    # Гонка за задание должна давать ровно одного победителя на каждое задание
+    for size, (_, (tasks, single, _, _)) in zip(args.sizes, results):
+        assert single == tasks, f"{size} tasks: {tasks - single} contended tasks did not get exactly one winner"
+
+
+if __name__ == '__main__':
+    main()
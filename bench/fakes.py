@@ -0,0 +1,97 @@
+"""Подмена сети Telegram и фабрика апдейтов для бенчмарка."""
+import json
+import time
+from collections import Counter
+from contextvars import ContextVar
+from itertools import count
+from telegram import Update
+from telegram.request import BaseRequest
+
+# Счётчики текущего апдейта: [SQL-запросы, вызовы Bot API]
+current_counters = ContextVar('current_counters', default=None)
+# Тексты отправленных и отредактированных ботом сообщений текущего апдейта
+current_replies = ContextVar('current_replies', default=None)
+
+_ids = count(1)
+
+
+def _user(chat_id):
+    return {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'}
+
+
+def _message(chat_id, text=None, from_bot=False):
+    data = {
+        'message_id': next(_ids),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': True, 'first_name': 'bench'} if from_bot else _user(chat_id),
+    }
+    if text is not None:
+        data['text'] = text
+        if text.startswith('/'):
+            command = text.split()[0]
+            data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return data
+
+
+class FakeRequest(BaseRequest):
+    """Отвечает на любой метод Bot API без сети и считает вызовы."""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        counters = current_counters.get()
+        if counters is not None:
+            counters[1] += 1
+
+        params = request_data.parameters if request_data else {}
+        chat_id = int(params.get('chat_id', 0) or 0)
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif endpoint == 'sendMediaGroup':
+            result = [_message(chat_id, from_bot=True) for _ in params.get('media', [])]
+        elif endpoint.startswith(('send', 'edit')):
+            replies = current_replies.get()
+            if replies is not None:
+                replies.append(params.get('text') or '')
+            result = _message(chat_id, params.get('text'), from_bot=True)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def message_update(bot, chat_id, text):
+    """Апдейт с текстовым сообщением (команды получают entity bot_command)."""
+    return Update.de_json({'update_id': next(_ids), 'message': _message(chat_id, text)}, bot)
+
+
+def callback_update(bot, chat_id, data):
+    """Апдейт с нажатием inline-кнопки под сообщением бота."""
+    return Update.de_json({
+        'update_id': next(_ids),
+        'callback_query': {
+            'id': str(next(_ids)),
+            'from': _user(chat_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': _message(chat_id, 'menu', from_bot=True),
+        },
+    }, bot)
+
+
+def inline_update(bot, user_id, query, offset=''):
+    """Апдейт с inline-запросом @бот <query>."""
+    return Update.de_json({
+        'update_id': next(_ids),
+        'inline_query': {'id': str(next(_ids)), 'from': _user(user_id), 'query': query, 'offset': offset},
+    }, bot)
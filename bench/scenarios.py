@@ -0,0 +1,276 @@
+"""Наполнение базы и сценарии нагрузки для бенчмарка.
+
+База должна быть выбрана через DATABASE_URL до импорта этого модуля
+(это делает bench/__main__.py).
+"""
+import asyncio
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from time import perf_counter
+from sqlalchemy import event, insert, select
+from telegram.ext import ApplicationBuilder
+from database import Base, engine, async_engine, AsyncSession, init_db, rebuild_teacher_stats, User, Subject, Task
+from queries import identity_cache
+from handlers import inline_cache
+from subjects import subject_registry
+from leaderboard import leaderboard
+from notifications import notifications
+from persistence import DatabasePersistence
+from main import ChatOrderedApplication, add_handlers
+from bench.fakes import FakeRequest, current_counters, current_replies, message_update, callback_update, inline_update
+
+# Диапазоны chat_id, чтобы роли не пересекались
+STUDENT_CHATS = 1_000_000
+HELPER_CHATS = 2_000_000
+TEACHER_CHATS = 3_000_000
+NEW_CHATS = 4_000_000
+
+SUBJECTS = 12
+TEACHERS = 10
+
+
+@event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counters = current_counters.get()
+    if counters is not None:
+        counters[0] += 1
+
+
+def seed(size, helpers, seed=42):
+    """Пересоздаёт базу: size заданий, helpers помощников, студенты и преподаватели."""
+    rnd = random.Random(seed)
+    Base.metadata.drop_all(engine)
+    init_db()
+    students = max(100, size // 20)
+    now = datetime.now()
+
+    with engine.begin() as conn:
+        conn.execute(insert(Subject), [{'name': f'Предмет {i}'} for i in range(1, SUBJECTS + 1)])
+        conn.execute(insert(User), [
+            {'chat_id': STUDENT_CHATS + i, 'full_name': f'Студент {i} гр. С-{i % 30}',
+             'group_name': f'С-{i % 30}', 'user_type': 'student'}
+            for i in range(students)
+        ] + [
+            {'chat_id': HELPER_CHATS + i, 'full_name': f'Помощник {i} гр. П-{i % 30}',
+             'group_name': f'П-{i % 30}', 'user_type': 'helper'}
+            for i in range(helpers)
+        ] + [
+            {'chat_id': TEACHER_CHATS + i, 'full_name': f'Преподаватель{i} А.Б.',
+             'group_name': None, 'user_type': 'teacher'}
+            for i in range(TEACHERS)
+        ])
+        ids = defaultdict(list)
+        for user_id, user_type in conn.execute(select(User.id, User.user_type).order_by(User.id)):
+            ids[user_type].append(user_id)
+        subject_ids = conn.execute(select(Subject.id)).scalars().all()
+
+        rows = []
+        for i in range(size):
+            # 60% новых, 25% в работе, 15% завершённых
+            bucket = i % 20
+            status = 'new' if bucket < 12 else 'in_progress' if bucket < 17 else 'completed'
+            teacher = rnd.randrange(TEACHERS)
+            rows.append({
+                'title': f'Задание {i}',
+                'description': f'Описание задания {i}. ' * 5,
+                'status': status,
+                'created_at': now - timedelta(minutes=size - i),
+                'deadline': now + timedelta(days=rnd.randint(2, 30)),
+                'teacher_name': f'Преподаватель{teacher} А.Б.',
+                'teacher_id': ids['teacher'][teacher],
+                'student_id': rnd.choice(ids['student']),
+                'helper_id': rnd.choice(ids['helper']) if status != 'new' else None,
+                'subject_id': rnd.choice(subject_ids),
+                'rating': rnd.randint(1, 5) if status == 'completed' else None,
+            })
+        conn.execute(insert(Task), rows)
+    rebuild_teacher_stats()
+
+
+def reset_caches():
+    identity_cache.clear()
+    inline_cache.clear()
+    subject_registry.invalidate()
+    leaderboard.invalidate()
+    # Очередь уведомлений в бенчмарке не запущена, сообщения просто копятся
+    notifications._pending.clear()
+
+
+class Bench:
+    """Прогоняет апдейты через Application и собирает задержки по обработчикам."""
+
+    def __init__(self, concurrency=16):
+        self.request = FakeRequest()
+        self.app = ApplicationBuilder()\
+            .token('1:bench')\
+            .request(self.request)\
+            .get_updates_request(FakeRequest())\
+            .application_class(ChatOrderedApplication)\
+            .concurrent_updates(concurrency)\
+            .persistence(DatabasePersistence(update_interval=3600))\
+            .build()
+        add_handlers(self.app)
+        self.app.add_error_handler(self._on_error)
+        self.concurrency = concurrency
+        self.samples = defaultdict(list)    # обработчик -> [(секунды, SQL, Bot API)]
+        self.runs = []                      # (сценарий, апдейтов, секунд)
+        self.errors = Counter()
+
+    async def _on_error(self, update, context):
+        self.errors[type(context.error).__name__] += 1
+
+    @property
+    def bot(self):
+        return self.app.bot
+
+    async def __aenter__(self):
+        await self.app.initialize()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.app.shutdown()
+
+    async def send(self, label, update):
+        counters = [0, 0]
+        token = current_counters.set(counters)
+        started = perf_counter()
+        try:
+            await self.app.process_update(update)
+        finally:
+            current_counters.reset(token)
+        self.samples[label].append((perf_counter() - started, counters[0], counters[1]))
+
+    async def run(self, name, flows):
+        """Запускает flows (корутины, по одной на пользователя) с ограничением параллелизма."""
+        limit = asyncio.Semaphore(self.concurrency)
+        before = sum(len(samples) for samples in self.samples.values())
+
+        async def limited(flow):
+            async with limit:
+                await flow
+
+        started = perf_counter()
+        await asyncio.gather(*(limited(flow) for flow in flows))
+        elapsed = perf_counter() - started
+        updates = sum(len(samples) for samples in self.samples.values()) - before
+        self.runs.append((name, updates, elapsed))
+        reset_caches()
+
+
+async def registration_storm(bench, count):
+    """Новые пользователи одновременно проходят /start -> роль -> ФИО."""
+    async def flow(i):
+        chat_id = NEW_CHATS + i
+        role = 'student' if i % 2 else 'helper'
+        await bench.send('start', message_update(bench.bot, chat_id, '/start'))
+        await bench.send('register_user', callback_update(bench.bot, chat_id, role))
+        await bench.send('complete_registration',
+                         message_update(bench.bot, chat_id, f'Новый {i} гр. Н-{i % 10}'))
+    await bench.run('registration storm', [flow(i) for i in range(count)])
+
+
+async def browsing(bench, helpers):
+    """Помощники открывают доступные задания, листают общий список и фильтр по предмету."""
+    async with AsyncSession() as session:
+        open_ids = (await session.scalars(select(Task.id).filter_by(status='new'))).all()
+    rnd = random.Random(1)
+
+    async def flow(i):
+        chat_id = HELPER_CHATS + i
+        await bench.send('show_available_tasks', callback_update(bench.bot, chat_id, 'available_tasks'))
+        await bench.send('filter_tasks', callback_update(bench.bot, chat_id, 'filter_tasks_all'))
+        await bench.send('filter_tasks', callback_update(
+            bench.bot, chat_id, f'filter_tasks_all:n:{rnd.choice(open_ids)}'))
+        await bench.send('filter_tasks', callback_update(
+            bench.bot, chat_id, f'filter_tasks_{rnd.randint(1, SUBJECTS)}'))
+    await bench.run('helpers browsing', [flow(i) for i in range(helpers)])
+
+
+async def searching(bench, helpers):
+    """Помощники ищут задания через /search и листают вторую страницу."""
+    rnd = random.Random(3)
+
+    async def flow(i):
+        chat_id = HELPER_CHATS + i
+        await bench.send('search_tasks', message_update(bench.bot, chat_id, f'/search задание {rnd.randint(1, 99)}'))
+        await bench.send('search_page', callback_update(bench.bot, chat_id, 'search_page_5'))
+    await bench.run('helpers searching', [flow(i) for i in range(helpers)])
+
+
+async def inline_browsing(bench, helpers):
+    """Inline-запросы: общий список с перелистыванием и поиск."""
+    async with AsyncSession() as session:
+        open_ids = (await session.scalars(select(Task.id).filter_by(status='new'))).all()
+    rnd = random.Random(4)
+
+    async def flow(i):
+        user_id = HELPER_CHATS + i
+        await bench.send('inline_tasks', inline_update(bench.bot, user_id, ''))
+        await bench.send('inline_tasks', inline_update(bench.bot, user_id, '', str(rnd.choice(open_ids))))
+        await bench.send('inline_tasks', inline_update(bench.bot, user_id, f'задание {rnd.randint(1, 99)}'))
+    await bench.run('inline browsing', [flow(i) for i in range(helpers)])
+
+
+async def choose_race(bench, tasks, contenders, helpers):
+    """Несколько помощников одновременно жмут «выбрать» на одном задании.
+
+    Исход считается по ответам бота каждому помощнику: «Вы выбрали задание»
+    или «уже взято». Возвращает (число заданий, сколько из них получили ровно
+    одного победителя, всего победителей, всего проигравших).
+    """
+    async with AsyncSession() as session:
+        task_ids = (await session.scalars(
+            select(Task.id).filter_by(status='new').order_by(Task.id.desc()).limit(tasks)
+        )).all()
+    rnd = random.Random(2)
+    outcomes = defaultdict(Counter)
+
+    async def contend(task_id, chat):
+        replies = []
+        token = current_replies.set(replies)
+        try:
+            await bench.send('choose_task', callback_update(bench.bot, HELPER_CHATS + chat, f'choose_task_{task_id}'))
+        finally:
+            current_replies.reset(token)
+        text = "\n".join(replies)
+        if "Вы выбрали задание" in text:
+            outcomes[task_id]['won'] += 1
+        elif "уже взято" in text:
+            outcomes[task_id]['lost'] += 1
+
+    flows = []
+    for task_id in task_ids:
+        for chat in rnd.sample(range(helpers), contenders):
+            flows.append(contend(task_id, chat))
+    await bench.run('choose_task race', flows)
+
+    single = sum(1 for task_id in task_ids if outcomes[task_id]['won'] == 1)
+    won = sum(outcome['won'] for outcome in outcomes.values())
+    lost = sum(outcome['lost'] for outcome in outcomes.values())
+    return len(task_ids), single, won, lost
+
+
+async def solution_burst(bench, count):
+    """Помощники одновременно отправляют решения взятых заданий."""
+    async with AsyncSession() as session:
+        rows = (await session.execute(
+            select(Task.id, User.chat_id)
+                .join(User, User.id == Task.helper_id)
+                .where(Task.status == 'in_progress')
+                .order_by(Task.id)
+                .limit(count)
+        )).all()
+
+    # Одно задание на помощника: иначе апдейты чата выстроятся в очередь
+    seen, assignments = set(), []
+    for task_id, chat_id in rows:
+        if chat_id not in seen:
+            seen.add(chat_id)
+            assignments.append((task_id, chat_id))
+
+    async def flow(task_id, chat_id):
+        await bench.send('submit_solution', callback_update(bench.bot, chat_id, f'submit_solution_{task_id}'))
+        await bench.send('receive_solution', message_update(bench.bot, chat_id, f'Решение задания {task_id}'))
+    await bench.run('receive_solution burst', [flow(*item) for item in assignments])
+
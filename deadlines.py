@@ -0,0 +1,107 @@
+"""Напоминания о дедлайнах и снятие просроченных заданий.
+
+Раз в interval секунд планировщик делает два запроса по индексу
+ix_tasks_status_deadline: берёт пачку заданий с близким дедлайном и
+рассылает напоминания через очередь уведомлений, а не взятые задания
+с прошедшим дедлайном переводит в статус 'expired'. Так они не
+попадают в «Доступные задания» и не раздувают их выборку.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, time, timedelta
+from database import AsyncSession
+from queries import due_for_reminder, mark_reminded, expire_overdue
+from notifications import notifications
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    def __init__(self, interval=600, remind_hours=24, batch_size=100):
+        self.interval = interval
+        self.remind_hours = remind_hours
+        self.batch_size = batch_size
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Ошибка планировщика дедлайнов")
+            await asyncio.sleep(self.interval)
+
+    async def tick(self, now=None):
+        """Один проход: напоминания и снятие просроченных заданий."""
+        now = now or datetime.now()
+        # Дедлайн хранится как начало дня сдачи: задание просрочено, когда этот день прошёл
+        today = datetime.combine(now.date(), time())
+        until = now + timedelta(hours=self.remind_hours)
+
+        reminded = expired = 0
+        while True:
+            async with AsyncSession() as session:
+                tasks = await due_for_reminder(session, today, until, self.batch_size)
+                if not tasks:
+                    break
+                await mark_reminded(session, [task.id for task in tasks], now)
+                await session.commit()
+            for task in tasks:
+                self._remind(task)
+            reminded += len(tasks)
+            if len(tasks) < self.batch_size:
+                break
+
+        while True:
+            async with AsyncSession() as session:
+                rows = await expire_overdue(session, today, self.batch_size)
+                await session.commit()
+            for task_id, title, chat_id in rows:
+                notifications.enqueue(
+                    chat_id,
+                    text=f"⌛ Срок задания «{title}» истёк, а помощник так и не нашёлся. "
+                         "Задание снято с публикации."
+                )
+            expired += len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+        if reminded or expired:
+            logger.info("Дедлайны: напоминаний %s, просрочено %s", reminded, expired)
+        return reminded, expired
+
+    def _remind(self, task):
+        deadline = task.deadline.strftime('%d.%m.%Y')
+        if task.status == 'new':
+            notifications.enqueue(
+                task.student.chat_id,
+                text=f"⏰ Дедлайн задания «{task.title}» — {deadline}, "
+                     "но его пока никто не взял."
+            )
+        else:
+            notifications.enqueue(
+                task.student.chat_id,
+                text=f"⏰ Дедлайн задания «{task.title}» — {deadline}. "
+                     f"Над ним работает {task.helper.full_name}."
+            )
+            notifications.enqueue(
+                task.helper.chat_id,
+                text=f"⏰ Напоминание: решение задания «{task.title}» нужно отправить до {deadline}."
+            )
+
+
+deadlines = DeadlineScheduler(
+    interval=int(os.getenv('DEADLINE_CHECK_INTERVAL', 600)),
+    remind_hours=int(os.getenv('DEADLINE_REMIND_HOURS', 24)),
+)
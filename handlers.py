@@ -1,10 +1,33 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, InputFile
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, InputFile, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import CallbackContext, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from database import Session, User, Task, Subject, func
+from database import AsyncSession, User, Task, link_teacher_tasks, COMPLETION_BUCKETS
 from datetime import datetime
 from sqlalchemy.orm import joinedload
+from queries import (
+    get_identity, remember_identity, get_task, count_open_tasks_by_subject,
+    page_open_tasks, page_student_tasks, page_helper_tasks, page_archived_tasks,
+    resolve_teacher, teacher_tasks, teacher_students, teacher_helpers,
+    claim_task, release_task, complete_task, record_rating, encode_cursor, decode_cursor,
+    count_transition, teacher_dashboard,
+    search_open_tasks, search_terms, PAGE_SIZE,
+    get_attachments, attachments_by_task, save_attachments, delete_attachments
+)
+from attachments import from_message, collect, delivery_calls, send_attachments, describe
+from notifications import notifications
+from leaderboard import leaderboard
+from cache import TTLCache
+from subjects import subject_registry
+from transfer import export_rows, teacher_tasks_export
+from rendering import (
+    ROLE_KEYBOARD, STUDENT_MENU, HELPER_MENU, TEACHER_MENU, BACK_BUTTONS, BACK_KEYBOARDS, ARCHIVE_BUTTON,
+    STATUS_ICONS, subject_keyboard, student_task_card, open_task_card
+)
 import re
+import html
 import logging
+import asyncio
+import os
+import tempfile
 
 # Настройка логгирования
 logger = logging.getLogger(__name__)
@@ -20,34 +43,52 @@ MENU_KEYBOARD = ReplyKeyboardMarkup(
     is_persistent=True
 )
 
+def parse_page(data):
+    # callback_data страницы: '<префикс>:n:<курсор>' (вперёд) или '<префикс>:p:<курсор>' (назад)
+    parts = data.split(':')
+    if len(parts) != 3:
+        return None, None
+    cursor = decode_cursor(parts[2])
+    return (cursor, None) if parts[1] == 'n' else (None, cursor)
+
+def page_buttons(prefix, tasks, has_prev, has_next, key):
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{prefix}:p:{encode_cursor(key(tasks[0]))}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"{prefix}:n:{encode_cursor(key(tasks[-1]))}"))
+    return [nav] if nav else []
+
+def my_tasks_key(task):
+    return task.status, task.id
+
 async def start(update: Update, context: CallbackContext) -> int:
     # Всегда сбрасываем состояние при старте
     context.user_data.clear()
     
     chat_id = update.effective_chat.id
     
-    with Session() as session:
-        user = session.query(User).filter_by(chat_id=chat_id).first()
-        
-        if user:
-            if user.user_type == 'student':
-                await student_menu(update, context)
-            elif user.user_type == 'helper':
-                await helper_menu(update, context)
-            elif user.user_type == 'teacher':
-                await teacher_menu(update, context)
+    user = await get_identity(chat_id)
+    
+    if user:
+        # Ссылка из inline-результата: t.me/<бот>?start=task_<id>
+        arg = context.args[0] if context.args else ''
+        if user.user_type == 'helper' and arg.startswith('task_') and arg[5:].isdigit():
+            await show_task_offer(update, context, int(arg[5:]))
             return ConversationHandler.END
-        else:
-            keyboard = [
-                [InlineKeyboardButton("Студент", callback_data='student')],
-                [InlineKeyboardButton("Помогающий студент", callback_data='helper')],
-                [InlineKeyboardButton("Преподаватель", callback_data='teacher')]
-            ]
-            await update.message.reply_text(
-                "Добро пожаловать! Выберите ваш статус:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return REGISTER_STATE
+        if user.user_type == 'student':
+            await student_menu(update, context)
+        elif user.user_type == 'helper':
+            await helper_menu(update, context)
+        elif user.user_type == 'teacher':
+            await teacher_menu(update, context)
+        return ConversationHandler.END
+    else:
+        await update.message.reply_text(
+            "Добро пожаловать! Выберите ваш статус:",
+            reply_markup=ROLE_KEYBOARD
+        )
+        return REGISTER_STATE
 
 async def register_user(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
@@ -77,7 +118,7 @@ async def complete_registration(update: Update, context: CallbackContext) -> int
             await update.message.reply_text("❌ Неверный формат. Укажите группу в формате: Иванов Иван гр. ИТ-1")
             return REGISTER_STATE
     
-    with Session() as session:
+    async with AsyncSession() as session:
         new_user = User(
             chat_id=chat_id,
             user_type=user_type,
@@ -90,7 +131,14 @@ async def complete_registration(update: Update, context: CallbackContext) -> int
                 new_user.group_name = match.group(1).strip()
         
         session.add(new_user)
-        session.commit()
+        await session.commit()
+        remember_identity(new_user)
+        if user_type == 'teacher':
+            # Привязываем задания, созданные до регистрации преподавателя
+            await session.run_sync(link_teacher_tasks, new_user.id, new_user.full_name)
+            await session.commit()
+    if user_type == 'helper':
+        leaderboard.invalidate()
     
     # Автоматически открываем соответствующее меню после регистрации
     if user_type == 'student':
@@ -108,19 +156,18 @@ async def menu_handler(update: Update, context: CallbackContext):
     
     chat_id = update.effective_chat.id
     
-    with Session() as session:
-        user = session.query(User).filter_by(chat_id=chat_id).first()
-        
-        if not user:
-            await update.message.reply_text("❌ Сначала зарегистрируйтесь через /start")
-            return
-        
-        if user.user_type == 'student':
-            await student_menu(update, context)
-        elif user.user_type == 'helper':
-            await helper_menu(update, context)
-        elif user.user_type == 'teacher':
-            await teacher_menu(update, context)
+    user = await get_identity(chat_id)
+    
+    if not user:
+        await update.message.reply_text("❌ Сначала зарегистрируйтесь через /start")
+        return
+    
+    if user.user_type == 'student':
+        await student_menu(update, context)
+    elif user.user_type == 'helper':
+        await helper_menu(update, context)
+    elif user.user_type == 'teacher':
+        await teacher_menu(update, context)
 
 async def student_menu(update: Update, context: CallbackContext):
     # Всегда сбрасываем состояние при входе в меню
@@ -128,33 +175,26 @@ async def student_menu(update: Update, context: CallbackContext):
     
     chat_id = update.effective_chat.id
     
-    with Session() as session:
-        user = session.query(User).filter_by(chat_id=chat_id).first()
-        if not user or user.user_type != 'student':
-            if isinstance(update, Update) and update.message:
-                await update.message.reply_text("❌ Доступно только для студентов", reply_markup=MENU_KEYBOARD)
-            else:
-                query = update.callback_query
-                await query.answer()
-                await query.edit_message_text("❌ Доступно только для студентов")
-            return
-    
-    keyboard = [
-        [InlineKeyboardButton("📝 Создать задание", callback_data='create_task')],
-        [InlineKeyboardButton("📋 Мои задания", callback_data='my_tasks')],
-        [InlineKeyboardButton("🏆 Рейтинг помощников", callback_data='helper_rating')],
-    ]
+    user = await get_identity(chat_id)
+    if not user or user.user_type != 'student':
+        if isinstance(update, Update) and update.message:
+            await update.message.reply_text("❌ Доступно только для студентов", reply_markup=MENU_KEYBOARD)
+        else:
+            query = update.callback_query
+            await query.answer()
+            await query.edit_message_text("❌ Доступно только для студентов")
+        return
     
     if isinstance(update, Update) and update.message:
         await update.message.reply_text(
             "👨‍🎓 Меню студента:",
-            reply_markup=InlineKeyboardMarkup(keyboard))
+            reply_markup=STUDENT_MENU)
     else:
         query = update.callback_query
         await query.answer()
         await query.edit_message_text(
             "👨‍🎓 Меню студента:",
-            reply_markup=InlineKeyboardMarkup(keyboard))
+            reply_markup=STUDENT_MENU)
     
     return
 
@@ -163,23 +203,18 @@ async def show_student_tasks(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     chat_id = update.effective_chat.id
+    after, before = parse_page(query.data)
     
-    # 2) сразу подгружаем связи subject и helper
-    with Session() as session:
-        user = session.query(User).filter_by(chat_id=chat_id).first()
-        tasks = session.query(Task)\
-                       .options(
-                           joinedload(Task.subject),
-                           joinedload(Task.helper)
-                       )\
-                       .filter_by(student_id=user.id)\
-                       .order_by(Task.status, Task.created_at)\
-                       .all()
+    # 2) сразу подгружаем связи subject и helper, не больше одной страницы
+    user = await get_identity(chat_id)
+    async with AsyncSession() as session:
+        tasks, has_prev, has_next = await page_student_tasks(session, user.id, after, before)
         
     if not tasks:
         await query.edit_message_text(
             "❗ У вас нет заданий.\n\n"
-            "Используйте /menu, чтобы вернуться в меню."
+            "Используйте /menu, чтобы вернуться в меню.",
+            reply_markup=InlineKeyboardMarkup([[ARCHIVE_BUTTON], [BACK_BUTTONS['student']]])
         )
         return
         
@@ -188,44 +223,16 @@ async def show_student_tasks(update: Update, context: CallbackContext):
     keyboard = []
         
     for task in tasks:
-        status_icon = {
-            'new': '🆕',
-            'in_progress': '🔄',
-            'completed': '✅'
-        }[task.status]
-        
-        lines = [
-            f"{status_icon} <b>{task.title}</b>",
-            f"📝 Описание: {task.description[:50]}…",
-            f"🏷 Предмет: {task.subject.name}",        # теперь доступно
-            f"👨‍🏫 Преподаватель: {task.teacher_name}",
-            f"📅 Создано: {task.created_at.strftime('%d.%m.%Y %H:%M')}",
-            f"⏰ Срок: {task.deadline.strftime('%d.%m.%Y')}",
-            f"🔄 Статус: {task.status}"
-        ]
-        if task.helper:
-            lines.append(f"👨‍🎓 Помощник: {task.helper.full_name}")
-        
-        message.append("\n".join(lines))
-        
-        # кнопки «Удалить» или «Оценить»
-        if task.status == 'new':
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"❌ Удалить '{task.title[:15]}…'",
-                    callback_data=f"delete_task_{task.id}"
-                )
-            ])
-        elif task.status == 'completed' and not task.rating:
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"⭐ Оценить '{task.title[:15]}…'",
-                    callback_data=f"rate_task_{task.id}"
-                )
-            ])
+        # карточка и кнопка «Удалить»/«Оценить» берутся из кэша, пока задание не менялось
+        card, button = student_task_card(task)
+        message.append(card)
+        if button:
+            keyboard.append([button])
     
-    # 4) единожды добавляем кнопку «В меню»
-    keyboard.append([InlineKeyboardButton("🔙 В меню", callback_data='back_to_student_menu')])
+    # 4) единожды добавляем навигацию и кнопку «В меню»
+    keyboard += page_buttons('my_tasks', tasks, has_prev, has_next, my_tasks_key)
+    keyboard.append([ARCHIVE_BUTTON])
+    keyboard.append([BACK_BUTTONS['student']])
     
     # 5) и только один раз шлём итоговое сообщение
     await query.edit_message_text(
@@ -235,23 +242,66 @@ async def show_student_tasks(update: Update, context: CallbackContext):
     )
 
 
+async def show_archive(update: Update, context: CallbackContext):
+    """Архив завершённых заданий студента или помощника, постранично."""
+    query = update.callback_query
+    await query.answer()
+    after, before = parse_page(query.data)
+
+    user = await get_identity(update.effective_chat.id)
+    if not user or user.user_type not in ('student', 'helper'):
+        await query.edit_message_text("❌ Архив доступен студентам и помогающим студентам")
+        return
+
+    async with AsyncSession() as session:
+        tasks, has_prev, has_next = await page_archived_tasks(session, user.user_type, user.id, after, before)
+
+    back = BACK_BUTTONS[user.user_type]
+    if not tasks:
+        await query.edit_message_text("📦 В архиве пока пусто", reply_markup=InlineKeyboardMarkup([[back]]))
+        return
+
+    lines = ["📦 <b>Архив заданий</b>"]
+    for task in tasks:
+        subject = await subject_registry.get(task.subject_id)
+        finished = task.completed_at or task.updated_at or task.created_at
+        line = (
+            f"✅ <b>{html.escape(task.title)}</b>\n"
+            f"🏷 {html.escape(subject.name if subject else '—')} · 📅 {finished.strftime('%d.%m.%Y')}"
+        )
+        if task.rating:
+            line += f" · ⭐ {task.rating}"
+        if user.user_type == 'student' and task.helper:
+            line += f"\n👨‍🎓 {html.escape(task.helper.full_name)}"
+        lines.append(line)
+
+    keyboard = page_buttons('archive', tasks, has_prev, has_next, lambda task: (task.id,))
+    keyboard.append([back])
+    await query.edit_message_text(
+        "\n\n".join(lines),
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
 async def delete_task(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     task_id = int(query.data.split('_')[2])
     
-    with Session() as session:
-        task = session.query(Task).get(task_id)
+    async with AsyncSession() as session:
+        task = await get_task(session, task_id)
         if not task:
             await query.edit_message_text("❌ Задание не найдено")
             return
             
-        if task.status != 'new':
-            await query.edit_message_text("❌ Можно удалять только новые задания")
+        if task.status not in ('new', 'expired'):
+            await query.edit_message_text("❌ Можно удалять только новые и просроченные задания")
             return
             
-        session.delete(task)
-        session.commit()
+        await count_transition(session, task.teacher_id, task.subject_id, old=task.status)
+        await delete_attachments(session, task.id)
+        await session.delete(task)
+        await session.commit()
     
     await query.edit_message_text("✅ Задание успешно удалено")
     await show_student_tasks(update, context)
@@ -279,28 +329,12 @@ async def set_rating(update: Update, context: CallbackContext):
         await query.edit_message_text("❌ Ошибка: задание не найдено")
         return
     
-    with Session() as session:
-        task = session.query(Task).get(task_id)
-        if not task or task.status != 'completed':
+    async with AsyncSession() as session:
+        if not await record_rating(session, task_id, rating):
             await query.edit_message_text("❌ Можно оценивать только завершенные задания")
             return
-            
-        task.rating = rating
-        session.commit()
-        
-        if task.helper:
-            helper = session.query(User).get(task.helper.id)
-            completed_tasks = session.query(Task)\
-                .filter_by(helper_id=helper.id, status='completed')\
-                .filter(Task.rating.isnot(None))\
-                .count()
-                
-            if completed_tasks > 0:
-                total_rating = session.query(func.sum(Task.rating))\
-                    .filter_by(helper_id=helper.id)\
-                    .scalar()
-                helper.rating = total_rating / completed_tasks
-                session.commit()
+        await session.commit()
+    leaderboard.invalidate()
     
     await query.edit_message_text(f"✅ Вы поставили оценку {rating} за задание")
     await show_student_tasks(update, context)
@@ -309,32 +343,27 @@ async def show_helper_rating(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     
-    with Session() as session:
-        helpers = session.query(User)\
-            .filter_by(user_type='helper')\
-            .order_by(User.rating.desc())\
-            .all()
+    # Топ-N берём из заранее отрисованного снимка
+    text = await leaderboard.text()
+    user = await get_identity(update.effective_chat.id)
+    role = 'helper' if user and user.user_type == 'helper' else 'student'
         
-    if not helpers:
+    if not text:
         await query.edit_message_text(
             "Пока нет помощников с рейтингом.\n\n"
             "Используйте /menu для возврата в меню."
         )
         return
 
-        
-    message = ["🏆 Рейтинг помощников:\n"]
-    for i, helper in enumerate(helpers, 1):
-        message.append(
-            f"{i}. {helper.full_name} - ⭐ {helper.rating:.1f} "
-            f"(выполнено заданий: {helper.completed_tasks})"
-        )
-        
-    keyboard = [[InlineKeyboardButton("🔙 В меню", callback_data='back_to_student_menu')]]
+    # Помощнику дополнительно показываем его место
+    if user and user.user_type == 'helper':
+        place, total = await leaderboard.position(user.id)
+        if place:
+            text += f"\n\n📍 Ваше место: {place} из {total}"
         
     await query.edit_message_text(
-        text="\n".join(message),
-        reply_markup=InlineKeyboardMarkup(keyboard))
+        text=text,
+        reply_markup=BACK_KEYBOARDS[role])
 
 async def helper_menu(update: Update, context: CallbackContext):
     # Всегда сбрасываем состояние при входе в меню
@@ -347,28 +376,22 @@ async def helper_menu(update: Update, context: CallbackContext):
         await query.answer()
         chat_id = query.message.chat_id
     
-    with Session() as session:
-        user = session.query(User).filter_by(chat_id=chat_id, user_type='helper').first()
-        if not user:
-            if isinstance(update, Update) and update.message:
-                await update.message.reply_text("❌ Доступно только для помогающих студентов", reply_markup=MENU_KEYBOARD)
-            else:
-                await query.edit_message_text("❌ Доступно только для помогающих студентов")
-            return
-    
-    keyboard = [
-        [InlineKeyboardButton("📋 Мои задания", callback_data='helper_my_tasks')],
-        [InlineKeyboardButton("🔍 Доступные задания", callback_data='available_tasks')],
-    ]
+    user = await get_identity(chat_id, 'helper')
+    if not user:
+        if isinstance(update, Update) and update.message:
+            await update.message.reply_text("❌ Доступно только для помогающих студентов", reply_markup=MENU_KEYBOARD)
+        else:
+            await query.edit_message_text("❌ Доступно только для помогающих студентов")
+        return
     
     if isinstance(update, Update) and update.message:
         await update.message.reply_text(
             "👨‍🏫 Меню помогающего студента:",
-            reply_markup=InlineKeyboardMarkup(keyboard))
+            reply_markup=HELPER_MENU)
     else:
         await query.edit_message_text(
             "👨‍🏫 Меню помогающего студента:",
-            reply_markup=InlineKeyboardMarkup(keyboard))
+            reply_markup=HELPER_MENU)
     
     return
 
@@ -378,18 +401,19 @@ async def show_available_tasks(update: Update, context: CallbackContext):
     await query.answer()
     chat_id = update.effective_chat.id
 
-    # Проверяем, что пользователь — помощник и сразу выгружаем новые задания
-    with Session() as session:
-        helper = session.query(User).filter_by(
-            chat_id=chat_id, user_type='helper'
-        ).first()
-        if not helper:
-            await query.edit_message_text("❌ Доступно только для помогающих студентов")
-            return
-        tasks = session.query(Task).filter_by(status='new').all()
+    # Проверяем, что пользователь — помощник, и одним GROUP BY считаем
+    # новые задания по всем предметам
+    helper = await get_identity(chat_id, 'helper')
+    if not helper:
+        await query.edit_message_text("❌ Доступно только для помогающих студентов")
+        return
+
+    async with AsyncSession() as session:
+        counts = await count_open_tasks_by_subject(session)
 
     # Если нет ни одного нового задания — сразу даём сообщение и инструкцию /menu
-    if not tasks:
+    total = sum(counts.values())
+    if not total:
         await query.edit_message_text(
             "❗ Нет доступных заданий.\n\n"
             "Используйте /menu, чтобы вернуться в меню."
@@ -397,22 +421,17 @@ async def show_available_tasks(update: Update, context: CallbackContext):
         return
 
     # Иначе — показываем меню фильтрации по предметам + «Все задания»
-    with Session() as session:
-        subjects = session.query(Subject).all()
-
-    total = len(tasks)
     keyboard = [
         [InlineKeyboardButton(f"Все задания ({total})", callback_data="filter_tasks_all")]
     ]
-    for subj in subjects:
-        cnt = session.query(Task)\
-            .filter_by(status='new', subject_id=subj.id)\
-            .count()
+    for subject in await subject_registry.all():
         keyboard.append([
-            InlineKeyboardButton(f"{subj.name} ({cnt})", callback_data=f"filter_tasks_{subj.id}")
+            InlineKeyboardButton(f"{subject.name} ({counts.get(subject.id, 0)})", callback_data=f"filter_tasks_{subject.id}")
         ])
 
-    keyboard.append([InlineKeyboardButton("🔙 В меню", callback_data='back_to_helper_menu')])
+    keyboard.append([InlineKeyboardButton("🔎 Поиск по словам", callback_data='search_help')])
+    keyboard.append([InlineKeyboardButton("📲 Листать в inline-режиме", switch_inline_query_current_chat='')])
+    keyboard.append([BACK_BUTTONS['helper']])
 
     await query.edit_message_text(
         "🔍 Выберите предмет или «Все задания»:",
@@ -420,40 +439,37 @@ async def show_available_tasks(update: Update, context: CallbackContext):
     )
 
 
+def open_task_lines(tasks, start=1):
+    """Строки списка открытых заданий и кнопки «выбрать» к ним."""
+    lines, kb = [], []
+    for i, t in enumerate(tasks, start):
+        lines.append(f"{i}. {open_task_card(t)}")
+        kb.append([InlineKeyboardButton(
+            f"{i} – {t.title}", 
+            callback_data=f"choose_task_{t.id}"
+        )])
+    return lines, kb
+
+
 async def filter_tasks(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
-    data = query.data           # e.g. "filter_tasks_all" или "filter_tasks_3"
-    parts = data.split("_")     # ["filter","tasks","all"] или ["filter","tasks","3"]
-    key = parts[-1]             # "all" или "3"
+    data = query.data           # e.g. "filter_tasks_all", "filter_tasks_3" или "filter_tasks_3:n:42"
+    prefix = data.split(":")[0]
+    key = prefix.split("_")[-1] # "all" или "3"
+    after, before = parse_page(data)
 
-    with Session() as session:
-        if key == "all":
-            tasks = session.query(Task).filter_by(status='new').all()
-        else:
-            subject_id = int(key)
-            tasks = session.query(Task).filter_by(
-                status='new',
-                subject_id=subject_id
-            ).all()
+    async with AsyncSession() as session:
+        subject_id = None if key == "all" else int(key)
+        tasks, has_prev, has_next = await page_open_tasks(session, subject_id, after, before)
 
     if not tasks:
         await query.edit_message_text("Нет доступных заданий.")
         return
 
-    lines, kb = [], []
-    for i, t in enumerate(tasks, 1):
-        lines.append(
-            f"{i}. <b>{t.title}</b>\n"
-            f"{t.description}\n"
-            f"⏰ Дедлайн: {t.deadline.strftime('%d.%m.%Y')}\n"
-        )
-        kb.append([InlineKeyboardButton(
-            f"{i} – {t.title}", 
-            callback_data=f"choose_task_{t.id}"
-        )])
-
-    kb.append([InlineKeyboardButton("🔙 В меню", callback_data='back_to_helper_menu')])
+    lines, kb = open_task_lines(tasks)
+    kb += page_buttons(prefix, tasks, has_prev, has_next, lambda t: (t.id,))
+    kb.append([BACK_BUTTONS['helper']])
     await query.edit_message_text(
         "\n".join(lines),
         parse_mode='HTML',
@@ -462,6 +478,155 @@ async def filter_tasks(update: Update, context: CallbackContext):
 
 
 
+async def search_results(words, offset):
+    """Текст и клавиатура страницы результатов поиска."""
+    async with AsyncSession() as session:
+        tasks, has_more = await search_open_tasks(session, words, offset)
+
+    back = [BACK_BUTTONS['helper']]
+    if not tasks:
+        return f"🔎 По запросу «{html.escape(words)}» ничего не найдено.", InlineKeyboardMarkup([back])
+
+    lines, kb = open_task_lines(tasks, offset + 1)
+    nav = []
+    if offset:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page_{max(0, offset - PAGE_SIZE)}"))
+    if has_more:
+        nav.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"search_page_{offset + PAGE_SIZE}"))
+    if nav:
+        kb.append(nav)
+    kb.append(back)
+    text = f"🔎 Результаты по запросу «{html.escape(words)}»:\n\n" + "\n".join(lines)
+    return text, InlineKeyboardMarkup(kb)
+
+
+async def search_tasks(update: Update, context: CallbackContext):
+    """/search <слова> — полнотекстовый поиск по открытым заданиям."""
+    helper = await get_identity(update.effective_chat.id, 'helper')
+    if not helper:
+        await update.message.reply_text("❌ Поиск доступен только помогающим студентам")
+        return
+
+    words = " ".join(context.args or [])
+    if not search_terms(words):
+        await update.message.reply_text(
+            "🔎 Укажите слова для поиска, например:\n/search интегралы матан"
+        )
+        return
+
+    # Запрос нужен для перелистывания страниц: в callback_data он не поместится
+    context.user_data['search_query'] = words
+    text, markup = await search_results(words, 0)
+    await update.message.reply_text(text, parse_mode='HTML', reply_markup=markup)
+
+
+async def search_page(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    words = context.user_data.get('search_query')
+    if not words:
+        await query.edit_message_text("🔎 Поиск устарел, повторите /search <слова>")
+        return
+    offset = int(query.data.split('_')[2])
+    text, markup = await search_results(words, offset)
+    await query.edit_message_text(text, parse_mode='HTML', reply_markup=markup)
+
+
+async def search_help(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        "🔎 Отправьте /search и слова из темы или описания задания.\n\n"
+        "Пример: /search интегралы по частям",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 К предметам", callback_data='available_tasks')]
+        ])
+    )
+
+
+# Inline-режим: общий для всех список открытых заданий
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = 60     # секунд; столько же Telegram кэширует ответ у себя
+inline_cache = TTLCache(maxsize=1024, ttl=INLINE_CACHE_TIME)
+
+
+def inline_task_result(task, bot_username):
+    deadline = task.deadline.strftime('%d.%m.%Y')
+    description = task.description if len(task.description) <= 300 else task.description[:300] + "…"
+    return InlineQueryResultArticle(
+        id=str(task.id),
+        title=task.title,
+        description=f"⏰ {deadline} · {task.description[:80]}",
+        input_message_content=InputTextMessageContent(
+            f"📌 <b>{html.escape(task.title)}</b>\n"
+            f"{html.escape(description)}\n"
+            f"⏰ Дедлайн: {deadline}",
+            parse_mode='HTML'
+        ),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+            "📖 Открыть в боте", url=f"https://t.me/{bot_username}?start=task_{task.id}"
+        )]])
+    )
+
+
+async def inline_tasks(update: Update, context: CallbackContext):
+    """@бот [слова] — открытые задания прямо в поле ввода.
+
+    Пустой запрос листает все открытые задания по id (offset — id последнего
+    на странице), непустой — результаты полнотекстового поиска (offset —
+    номер позиции). Ответ одинаков для всех пользователей, поэтому
+    is_personal=False и повторные запросы Telegram отдаёт из своего кэша.
+    """
+    inline_query = update.inline_query
+    words = inline_query.query.strip()
+    offset = inline_query.offset if inline_query.offset.isdigit() else ''
+    key = (" ".join(search_terms(words)), offset)
+
+    cached = inline_cache.get(key)
+    if cached is None:
+        async with AsyncSession() as session:
+            if key[0]:
+                start = int(offset or 0)
+                tasks, has_more = await search_open_tasks(session, words, start, INLINE_PAGE_SIZE)
+                next_offset = str(start + INLINE_PAGE_SIZE) if has_more else ''
+            else:
+                after = (int(offset),) if offset else None
+                tasks, _, has_more = await page_open_tasks(session, after=after, limit=INLINE_PAGE_SIZE)
+                next_offset = str(tasks[-1].id) if has_more else ''
+        results = [inline_task_result(task, context.bot.username) for task in tasks]
+        cached = (results, next_offset)
+        inline_cache.set(key, cached)
+
+    results, next_offset = cached
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset
+    )
+
+
+async def show_task_offer(update: Update, context: CallbackContext, task_id):
+    """Карточка открытого задания с кнопкой «Взять» (переход из inline-результата)."""
+    async with AsyncSession() as session:
+        task = await get_task(session, task_id, Task.subject)
+    if not task or task.status != 'new':
+        await update.message.reply_text("❌ Задание уже взято или снято с публикации")
+        return
+
+    await update.message.reply_text(
+        f"📌 <b>{html.escape(task.title)}</b>\n\n"
+        f"{html.escape(task.description)}\n\n"
+        f"🏷 <b>Предмет:</b> {html.escape(task.subject.name)}\n"
+        f"⏰ <b>Дедлайн:</b> {task.deadline.strftime('%d.%m.%Y')}",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Взять задание", callback_data=f"choose_task_{task.id}")],
+            [BACK_BUTTONS['helper']]
+        ])
+    )
+
+
 from sqlalchemy.orm import joinedload
 
 async def choose_task(update: Update, context: CallbackContext):
@@ -469,24 +634,20 @@ async def choose_task(update: Update, context: CallbackContext):
     await query.answer()
     task_id = int(query.data.split("_")[2])
 
-    # Загружаем задачу вместе с предметом и автором
-    with Session() as session:
-        task = (
-            session.query(Task)
-                   .options(
-                        joinedload(Task.subject),
-                        joinedload(Task.student)
-                   )
-                   .get(task_id)
-        )
-        helper = session.query(User)\
-                        .filter_by(chat_id=update.effective_chat.id, user_type='helper')\
-                        .first()
+    helper = await get_identity(update.effective_chat.id, 'helper')
+    if not helper:
+        await query.edit_message_text("❌ Доступно только для помогающих студентов")
+        return
 
-        # Переводим задачу в in_progress
-        task.status    = 'in_progress'
-        task.helper_id = helper.id
-        session.commit()
+    async with AsyncSession() as session:
+        # Переводим задачу в in_progress одним условным UPDATE
+        if not await claim_task(session, task_id, helper.id):
+            await query.edit_message_text("❌ Задание уже взято другим помощником")
+            return
+        await session.commit()
+
+        # Загружаем задачу вместе с предметом и автором
+        task = await get_task(session, task_id, Task.subject, Task.student)
 
         # Собираем текст сообщения
         text = (
@@ -498,45 +659,27 @@ async def choose_task(update: Update, context: CallbackContext):
             f"⏰ <b>Дедлайн:</b> {task.deadline.strftime('%d.%m.%Y')}\n"
         )
 
-        # Добавляем информацию о вложении, если оно есть
-        if task.attachment_id:
-            name = task.attachment_name or 'файл'
-            text += f"\n📎 Вложение: {name}"
+        # Добавляем информацию о вложениях, если они есть
+        files = await get_attachments(session, task)
+        if files:
+            text += f"\n📎 Вложения: {html.escape(describe(files))}"
 
     # Редактируем сообщение помощнику
     await query.edit_message_text(
         text=text,
         parse_mode='HTML',
-        reply_markup=InlineKeyboardMarkup([[ 
-            InlineKeyboardButton("🔙 В меню", callback_data='back_to_helper_menu') 
-        ]])
+        reply_markup=BACK_KEYBOARDS['helper']
     )
-    if task.attachment_id:
-    # мы сохраняли attachment_name='фото' для фото, иначе — real filename
-        if task.attachment_name == 'фото':
-        # отправляем как фото
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=task.attachment_id
-            )
-        else:
-        # отправляем как документ, с оригинальным именем в подписи
-            await context.bot.send_document(
-                chat_id=update.effective_chat.id,
-                document=task.attachment_id,
-                filename=task.attachment_name  # необязательно, но полезно
-            )
+    # Файлы уже лежат в Telegram: пересылаем по file_id, несколько — альбомами
+    await send_attachments(context.bot, update.effective_chat.id, files)
     # Уведомляем студента, что его задачу взяли в работу
-    try:
-        await context.bot.send_message(
-            chat_id=task.student.chat_id,
-            text=(
-                f"🎉 Вашу задачу «{task.title}» взял в работу "
-                f"помощник: {helper.full_name}"
-            )
+    notifications.enqueue(
+        task.student.chat_id,
+        text=(
+            f"🎉 Вашу задачу «{task.title}» взял в работу "
+            f"помощник: {helper.full_name}"
         )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления студента: {e}")
+    )
 
 
 
@@ -546,32 +689,24 @@ async def take_task(update: Update, context: CallbackContext):
     task_id = int(query.data.split('_')[2])
     helper_chat_id = update.effective_chat.id
 
-    with Session() as session:
-        task = session.query(Task).get(task_id)
-        helper = session.query(User)\
-                        .filter_by(chat_id=helper_chat_id, user_type='helper')\
-                        .first()
-
-        if not task or not helper:
-            await query.edit_message_text("❌ Ошибка: задание или пользователь не найдены")
-            return
+    helper = await get_identity(helper_chat_id, 'helper')
+    if not helper:
+        await query.edit_message_text("❌ Ошибка: задание или пользователь не найдены")
+        return
 
-        if task.status != 'new':
+    async with AsyncSession() as session:
+        if not await claim_task(session, task_id, helper.id):
             await query.edit_message_text("❌ Задание уже взято другим помощником")
             return
+        await session.commit()
 
-        task.status    = 'in_progress'
-        task.helper_id = helper.id
-        session.commit()
+        task = await get_task(session, task_id, Task.student)
 
     await query.edit_message_text(f"✅ Вы взяли задание: {task.title}")
-    try:
-        await context.bot.send_message(
-            chat_id=task.student.chat_id,
-            text=f"🎉 Ваше задание '{task.title}' взял в работу помощник: {helper.full_name}"
-        )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления студента: {e}")
+    notifications.enqueue(
+        task.student.chat_id,
+        text=f"🎉 Ваше задание '{task.title}' взял в работу помощник: {helper.full_name}"
+    )
 
     await helper_menu(update, context)
 
@@ -581,20 +716,21 @@ async def show_helper_tasks(update, context):
     query = update.callback_query
     await query.answer()
     helper_chat = update.effective_chat.id
+    after, before = parse_page(query.data)
 
-    with Session() as session:
-        helper = session.query(User).filter_by(
-            chat_id=helper_chat, user_type='helper'
-        ).first()
-        if not helper:
-            await query.edit_message_text("❌ Доступно только для помогающих студентов")
-            return
-        tasks = session.query(Task).filter_by(helper_id=helper.id).all()
+    helper = await get_identity(helper_chat, 'helper')
+    if not helper:
+        await query.edit_message_text("❌ Доступно только для помогающих студентов")
+        return
+
+    async with AsyncSession() as session:
+        tasks, has_prev, has_next = await page_helper_tasks(session, helper.id, after, before)
 
     if not tasks:
         await query.edit_message_text(
             "❗ У вас нет взятых заданий.\n\n"
-            "Используйте /menu, чтобы вернуться в меню."
+            "Используйте /menu, чтобы вернуться в меню.",
+            reply_markup=InlineKeyboardMarkup([[ARCHIVE_BUTTON], [BACK_BUTTONS['helper']]])
         )
         return
 
@@ -619,7 +755,9 @@ async def show_helper_tasks(update, context):
                 )
             ])
 
-    kb.append([InlineKeyboardButton("🔙 В меню", callback_data='back_to_helper_menu')])
+    kb += page_buttons('helper_my_tasks', tasks, has_prev, has_next, my_tasks_key)
+    kb.append([ARCHIVE_BUTTON])
+    kb.append([BACK_BUTTONS['helper']])
 
     await query.edit_message_text(
         "\n".join(lines),
@@ -637,16 +775,12 @@ async def info_task(update: Update, context: CallbackContext):
     chat_id = query.message.chat_id  # <-- определили chat_id
 
     # Получаем задачу вместе со связями
-    with Session() as session:
-        task = (
-            session.query(Task)
-                   .options(
-                       joinedload(Task.subject),
-                       joinedload(Task.student),
-                       joinedload(Task.helper)
-                   )
-                   .get(int(query.data.split("_")[2]))
+    async with AsyncSession() as session:
+        task = await get_task(
+            session, int(query.data.split("_")[2]),
+            Task.subject, Task.student, Task.helper
         )
+        files = await get_attachments(session, task)
 
     # Собираем текст
     text = (
@@ -662,9 +796,7 @@ async def info_task(update: Update, context: CallbackContext):
         text += f"\n👨‍🎓 <b>Помощник:</b> {task.helper.full_name}"
 
     # Кнопка «В меню»
-    menu_kb = InlineKeyboardMarkup([[
-        InlineKeyboardButton("🔙 В меню", callback_data='back_to_helper_menu')
-    ]])
+    menu_kb = BACK_KEYBOARDS['helper']
 
     # Шлём основное описание
     await context.bot.send_message(
@@ -674,26 +806,15 @@ async def info_task(update: Update, context: CallbackContext):
         reply_markup=menu_kb
     )
 
-    # Если есть вложение — отправляем его
-    if task.attachment_id:
-        if task.attachment_name == 'фото':
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=task.attachment_id
-            )
-        else:
-            await context.bot.send_document(
-                chat_id=chat_id,
-                document=task.attachment_id,
-                filename=task.attachment_name
-            )
+    # Если есть вложения — отправляем их
+    await send_attachments(context.bot, chat_id, files)
 
 async def view_my_task(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     tid = int(query.data.split("_")[3])
-    with Session() as session:
-        t = session.query(Task).get(tid)
+    async with AsyncSession() as session:
+        t = await get_task(session, tid, Task.subject, Task.student)
 
     text = (
         f"<b>{t.title}</b>\n\n"
@@ -708,7 +829,7 @@ async def view_my_task(update: Update, context: CallbackContext):
           InlineKeyboardButton("📤 Отправить решение", callback_data=f"submit_solution_{tid}"),
           InlineKeyboardButton("❌ Отказаться",          callback_data=f"abandon_task_{tid}")
         ],
-        [InlineKeyboardButton("🔙 В меню", callback_data='back_to_helper_menu')]
+        [BACK_BUTTONS['helper']]
     ]
     await query.edit_message_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(kb))
 
@@ -718,31 +839,25 @@ async def abandon_task(update: Update, context: CallbackContext):
     task_id = int(query.data.split('_')[2])
     helper_chat_id = update.effective_chat.id
     
-    with Session() as session:
+    helper = await get_identity(helper_chat_id, 'helper')
+    async with AsyncSession() as session:
         # Получаем задание и помощника
-        task = session.query(Task).get(task_id)
-        helper = session.query(User).filter_by(chat_id=helper_chat_id, user_type='helper').first()
+        task = await get_task(session, task_id, Task.student)
         
-        if not task or not helper or task.helper_id != helper.id:
+        # Возвращаем задание в статус "новое", только если оно ещё в работе у этого помощника
+        if not task or not helper or not await release_task(session, task.id, helper.id):
             await query.edit_message_text("❌ Ошибка: задание не найдено или вы не являетесь исполнителем")
             return
-        
-        # Возвращаем задание в статус "новое"
-        task.status = 'new'
-        task.helper_id = None
-        session.commit()
+        await session.commit()
         
         # Уведомление помощнику
         await query.edit_message_text(f"❌ Вы отказались от задания: {task.title}")
         
         # Уведомление студенту
-        try:
-            await context.bot.send_message(
-                chat_id=task.student.chat_id,
-                text=f"⚠️ Помощник отказался от выполнения вашего задания '{task.title}'. Задание снова доступно для выполнения."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления студента: {e}")
+        notifications.enqueue(
+            task.student.chat_id,
+            text=f"⚠️ Помощник отказался от выполнения вашего задания '{task.title}'. Задание снова доступно для выполнения."
+        )
         
         # Показываем обновленный список заданий помощника
         await show_helper_tasks(update, context)
@@ -756,76 +871,71 @@ async def submit_solution(update: Update, context: CallbackContext) -> int:
     context.user_data['solution_task_id'] = task_id
     
     await query.edit_message_text(
-        "📤 Отправьте решение задания (текст, фото, документ или архив):\n\n"
+        "📤 Отправьте решение задания (текст, фото, видео, документ или архив).\n"
+        "Несколько файлов — альбомом, затем /done.\n\n"
         "Используйте /cancel для отмены")
     return SEND_SOLUTION
 
 async def receive_solution(update: Update, context: CallbackContext) -> int:
+    """Текст или одиночный файл сразу завершает задание, файлы альбома копятся до /done."""
+    if update.message.text:
+        return await complete_solution(update, context, update.message.text)
+    if from_message(update.message) is None:
+        await update.message.reply_text("❌ Неподдерживаемый формат решения")
+        return SEND_SOLUTION
+    if await collect_album_item(update, context, 'solution_files',
+                                "Можно добавить ещё или отправьте /done, чтобы отправить решение"):
+        return SEND_SOLUTION
+    return await complete_solution(update, context)
+
+async def finish_solution(update: Update, context: CallbackContext) -> int:
+    if not context.user_data.get('solution_files'):
+        await update.message.reply_text("❌ Сначала отправьте решение: текст или файлы")
+        return SEND_SOLUTION
+    return await complete_solution(update, context)
+
+async def complete_solution(update: Update, context: CallbackContext, solution_text=None) -> int:
     task_id = context.user_data.get('solution_task_id')
     helper_chat_id = update.effective_chat.id
+    files = context.user_data.get('solution_files', [])
     
     if not task_id:
         await update.message.reply_text("❌ Ошибка: задание не найдено")
         return ConversationHandler.END
     
-    with Session() as session:
+    helper = await get_identity(helper_chat_id, 'helper')
+    async with AsyncSession() as session:
         # Получаем задание и помощника
-        task = session.query(Task).get(task_id)
-        helper = session.query(User).filter_by(chat_id=helper_chat_id, user_type='helper').first()
+        task = await get_task(session, task_id, Task.student)
         
         if not task or not helper or task.helper_id != helper.id:
             await update.message.reply_text("❌ Ошибка: задание не найдено или вы не являетесь исполнителем")
             return ConversationHandler.END
         
-        # Сохраняем решение в зависимости от типа
-        if update.message.text:
-            # Текстовое решение
-            task.solution_text = update.message.text
-        elif update.message.document:
-            # Документ (PDF, Word и т.д.)
-            task.solution_file_id = update.message.document.file_id
-        elif update.message.photo:
-            # Фото (берем самое высокое разрешение)
-            task.solution_file_id = update.message.photo[-1].file_id
-        else:
-            await update.message.reply_text("❌ Неподдерживаемый формат решения")
-            return SEND_SOLUTION
+        # Статус и текст решения — одним условным UPDATE: повторная отправка
+        # уже завершённого задания ничего не засчитывает
+        if not await complete_task(session, task.id, helper.id, solution_text, datetime.now()):
+            await update.message.reply_text("❌ Задание уже завершено")
+            context.user_data.clear()
+            return ConversationHandler.END
         
-        # Обновляем статус задания
-        task.status = 'completed'
-        helper.completed_tasks += 1
-        session.commit()
+        # Файлы решения вместе с их типом — в attachments
+        await save_attachments(session, task.id, 'solution', files)
+        await session.commit()
+        leaderboard.invalidate()
         
         # Уведомление помощнику
         await update.message.reply_text("✅ Решение успешно отправлено студенту!")
         
-        # Уведомление студенту
-        try:
-            message = f"🎉 По вашему заданию '{task.title}' готово решение!\nПомощник: {helper.full_name}"
-            
-            if task.solution_text:
-                await context.bot.send_message(
-                    chat_id=task.student.chat_id,
-                    text=f"{message}\n\nРешение:\n{task.solution_text}"
-                )
-            elif task.solution_file_id:
-                await context.bot.send_message(
-                    chat_id=task.student.chat_id,
-                    text=message
-                )
-                # Отправляем файл или фото
-                if update.message.document:
-                    await context.bot.send_document(
-                        chat_id=task.student.chat_id,
-                        document=task.solution_file_id
-                    )
-                else:  # photo
-                    await context.bot.send_photo(
-                        chat_id=task.student.chat_id,
-                        photo=task.solution_file_id
-                    )
-        except Exception as e:
-            logger.error(f"Ошибка отправки решения студенту: {e}")
+        # Уведомление студенту: сообщения одного чата уходят по порядку
+        message = f"🎉 По вашему заданию '{task.title}' готово решение!\nПомощник: {helper.full_name}"
+        
+        if solution_text:
+            message += f"\n\nРешение:\n{solution_text}"
+        notifications.enqueue(task.student.chat_id, text=message)
+        # Файлы тем же методом, каким их прислали; несколько — альбомами
+        for method, kwargs in delivery_calls(files):
+            notifications.enqueue(task.student.chat_id, method, **kwargs)
     
     # Очищаем состояние после отправки решения
     context.user_data.clear()
@@ -855,19 +965,12 @@ async def task_description_received(update: Update, context: CallbackContext) ->
     logger.info("Создание задания: пользователь %s ввёл описание", update.effective_chat.id)
     context.user_data['task_desc'] = update.message.text
     
-    with Session() as session:
-        subjects = session.query(Subject).all()
-    
-    keyboard = []
-    if subjects:
-        for subject in subjects:
-            keyboard.append([InlineKeyboardButton(subject.name, callback_data=f"subj_{subject.id}")])
-    
-    keyboard.append([InlineKeyboardButton("➕ Добавить новый предмет", callback_data="new_subject")])
+    # Список предметов берём из кэша, без обращения к базе
+    subjects = await subject_registry.all()
     
     await update.message.reply_text(
         "Выберите предмет:",
-        reply_markup=InlineKeyboardMarkup(keyboard))
+        reply_markup=subject_keyboard(subjects))
     return CREATE_TASK_SUBJECT
 
 async def task_subject_received(update: Update, context: CallbackContext) -> int:
@@ -884,23 +987,18 @@ async def task_subject_received(update: Update, context: CallbackContext) -> int
             await query.edit_message_text("Введите ФИО преподавателя:")
             return CREATE_TASK_TEACHER
     else:
-        subject_name = update.message.text
-        
-        with Session() as session:
-            existing_subject = session.query(Subject).filter_by(name=subject_name).first()
-            if existing_subject:
-                context.user_data['subject_id'] = existing_subject.id
-            else:
-                new_subject = Subject(name=subject_name)
-                session.add(new_subject)
-                session.commit()
-                context.user_data['subject_id'] = new_subject.id
+        # Похожее название («матан» / «Матан.») даёт уже существующий предмет
+        subject = await subject_registry.resolve(update.message.text)
+        context.user_data['subject_id'] = subject.id
         
         await update.message.reply_text("Введите ФИО преподавателя:")
         return CREATE_TASK_TEACHER
 
 async def task_teacher_received(update: Update, context: CallbackContext) -> int:
     context.user_data['teacher_name'] = update.message.text
+    # Сопоставляем имя с зарегистрированным преподавателем один раз, при записи
+    async with AsyncSession() as session:
+        context.user_data['teacher_id'] = await resolve_teacher(session, update.message.text)
     await update.message.reply_text(
         "Укажите срок выполнения в формате ДД.MM.ГГГГ\n"
         "(дата должна быть > сегодняшнего дня):")
@@ -922,66 +1020,74 @@ async def task_deadline_received(update, context) -> int:
 
     context.user_data['deadline'] = deadline
     await update.message.reply_text(
-        "Прикрепите файл (изображение, документ, PDF, архив)\n"
-        "или нажмите /skip, чтобы пропустить"
+        "Прикрепите файл (изображение, видео, документ, PDF, архив)\n"
+        "или альбом из нескольких файлов и затем /done.\n"
+        "Нажмите /skip, чтобы пропустить"
     )
     return CREATE_TASK_ATTACHMENT
 
+async def collect_album_item(update: Update, context: CallbackContext, key, prompt):
+    """Добавляет файл в user_data[key]. True — ждём ещё файлы (альбом), False — можно завершать.
+
+    Альбом Telegram приходит отдельными сообщениями с общим media_group_id,
+    поэтому файлы альбома копятся до /done, а отвечаем один раз на альбом.
+    """
+    files = context.user_data.setdefault(key, [])
+    collect(files, update.message)
+    group = update.message.media_group_id
+    if not group and not context.user_data.get(key + '_group'):
+        return False
+    if group and context.user_data.get(key + '_group') != group:
+        context.user_data[key + '_group'] = group
+        await update.message.reply_text(f"📎 Файлы получены. {prompt}")
+    elif not group:
+        await update.message.reply_text(f"📎 Добавлено файлов: {len(files)}. {prompt}")
+    return True
+
 async def task_attachment_received(update: Update, context: CallbackContext) -> int:
-    """Принимает фото или любой документ и создаёт задачу."""
-    # 1) Собираем attachment_id/name
-    if update.message.photo:
-        f = update.message.photo[-1]
-        context.user_data['attachment_id']   = f.file_id
-        context.user_data['attachment_name'] = 'фото'
-    elif update.message.document:
-        doc = update.message.document
-        context.user_data['attachment_id']   = doc.file_id
-        # если у файла есть имя — сохраняем, иначе просто 'документ'
-        context.user_data['attachment_name'] = doc.file_name or 'документ'
-    else:
-        context.user_data['attachment_id']   = None
-        context.user_data['attachment_name'] = None
+    """Принимает фото, видео, аудио или документ; одиночный файл сразу создаёт задачу."""
+    if await collect_album_item(update, context, 'attachments',
+                                "Можно добавить ещё или отправьте /done, чтобы создать задание"):
+        return CREATE_TASK_ATTACHMENT
+    return await finish_task_creation(update, context)
 
-    # 2) Дальше идёт ваш код из старого task_photo_received, 
-    #    только вместо photo_id используйте attachment_id и attachment_name.
-    #    Пример (упрощённо):
+async def finish_task_creation(update: Update, context: CallbackContext) -> int:
     chat_id     = update.effective_chat.id
     title       = context.user_data['task_title']
     description = context.user_data['task_desc']
     subject_id  = context.user_data['subject_id']
     teacher     = context.user_data['teacher_name']
     deadline    = context.user_data['deadline']
-    attach_id   = context.user_data.get('attachment_id')
-    attach_name = context.user_data.get('attachment_name')
+    files       = context.user_data.get('attachments', [])
 
-    with Session() as session:
-        user = session.query(User).filter_by(chat_id=chat_id, user_type='student').first()
+    user = await get_identity(chat_id, 'student')
+    async with AsyncSession() as session:
         new_task = Task(
             title=title,
             description=description,
             subject_id=subject_id,
             teacher_name=teacher,
+            teacher_id=context.user_data.get('teacher_id'),
             deadline=deadline,
             student_id=user.id,
-            attachment_id=attach_id,
-            attachment_name=attach_name,
             status='new'
         )
         session.add(new_task)
-        session.commit()
+        await session.flush()
+        await save_attachments(session, new_task.id, 'task', files)
+        await count_transition(session, new_task.teacher_id, subject_id, new='new')
+        await session.commit()
 
-    # 3) Очищаем context и возвращаем меню
+    # Очищаем context и возвращаем меню
     context.user_data.clear()
     await update.message.reply_text("✅ Задание создано!", reply_markup=MENU_KEYBOARD)
     await student_menu(update, context)
     return ConversationHandler.END
 
 async def skip_attachment(update: Update, context: CallbackContext) -> int:
-    # если пользователь нажал /skip — просто делаем то же самое,
-    # что и task_attachment_received без вложения.
-    update.message.text = None
-    return await task_attachment_received(update, context)
+    # /skip — создаём задание без вложений
+    context.user_data.pop('attachments', None)
+    return await finish_task_creation(update, context)
 
 """    logger.info("Создание задания: пользователь %s завершает задание", update.effective_chat.id)
     if update.message.photo:
@@ -1036,33 +1142,26 @@ async def teacher_menu(update: Update, context: CallbackContext):
     
     chat_id = update.effective_chat.id
     
-    with Session() as session:
-        user = session.query(User).filter_by(chat_id=chat_id, user_type='teacher').first()
-        if not user:
-            if isinstance(update, Update) and update.message:
-                await update.message.reply_text("❌ Доступно только для преподавателей", reply_markup=MENU_KEYBOARD)
-            else:
-                query = update.callback_query
-                await query.answer()
-                await query.edit_message_text("❌ Доступно только для преподавателей")
-            return
-    
-    keyboard = [
-        [InlineKeyboardButton("📋 Задания моих студентов", callback_data='teacher_student_tasks')],
-        [InlineKeyboardButton("👨‍🎓 Студенты, загрузившие задания", callback_data='teacher_students')],
-        [InlineKeyboardButton("👨‍🏫 Помогающие студенты по моим заданиям", callback_data='teacher_helpers')],
-    ]
+    user = await get_identity(chat_id, 'teacher')
+    if not user:
+        if isinstance(update, Update) and update.message:
+            await update.message.reply_text("❌ Доступно только для преподавателей", reply_markup=MENU_KEYBOARD)
+        else:
+            query = update.callback_query
+            await query.answer()
+            await query.edit_message_text("❌ Доступно только для преподавателей")
+        return
     
     if isinstance(update, Update) and update.message:
         await update.message.reply_text(
             "👨‍🏫 Меню преподавателя:",
-            reply_markup=InlineKeyboardMarkup(keyboard))
+            reply_markup=TEACHER_MENU)
     else:
         query = update.callback_query
         await query.answer()
         await query.edit_message_text(
             "👨‍🏫 Меню преподавателя:",
-            reply_markup=InlineKeyboardMarkup(keyboard))
+            reply_markup=TEACHER_MENU)
     
     return
 
@@ -1070,7 +1169,7 @@ from sqlalchemy.orm import joinedload
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram import Update
 from telegram.ext import CallbackContext
-from database import Session, User, Task
+from database import AsyncSession, User, Task
 
 async def show_teacher_student_tasks(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -1078,25 +1177,14 @@ async def show_teacher_student_tasks(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
 
     # Забираем задачи преподавателя, сразу подгружая subject, student и helper
-    with Session() as session:
-        teacher = session.query(User) \
-                         .filter_by(chat_id=chat_id, user_type='teacher') \
-                         .first()
-        if not teacher:
-            await query.edit_message_text("❌ Доступно только для преподавателей")
-            return
+    teacher = await get_identity(chat_id, 'teacher')
+    if not teacher:
+        await query.edit_message_text("❌ Доступно только для преподавателей")
+        return
 
-        tasks = (
-            session.query(Task)
-                   .options(
-                       joinedload(Task.subject),
-                       joinedload(Task.student),
-                       joinedload(Task.helper)
-                   )
-                   .filter(Task.teacher_name.ilike(f"%{teacher.full_name}%"))
-                   .order_by(Task.created_at)
-                   .all()
-        )
+    async with AsyncSession() as session:
+        tasks = await teacher_tasks(session, teacher.id)
+        files = await attachments_by_task(session, tasks)
 
     # Если нет ни одной задачи — отрисуем сообщение
     if not tasks:
@@ -1113,10 +1201,9 @@ async def show_teacher_student_tasks(update: Update, context: CallbackContext):
             f"👤 Студент: {task.student.full_name}"
         ]
 
-        # Вложение, если есть
-        if task.attachment_id:
-            name = task.attachment_name or "файл"
-            block.append(f"📎 Вложение: {name}")
+        # Вложения, если есть
+        if files[task.id]:
+            block.append(f"📎 Вложения: {html.escape(describe(files[task.id]))}")
 
         # Помощник, если есть
         if task.helper:
@@ -1125,15 +1212,11 @@ async def show_teacher_student_tasks(update: Update, context: CallbackContext):
         block.append(f"🔄 Статус: {task.status}")
         message_lines.append("\n".join(block) + "\n")
 
-    keyboard = [
-        [InlineKeyboardButton("🔙 В меню", callback_data="back_to_teacher_menu")]
-    ]
-
     # Отправляем единым сообщением
     await query.edit_message_text(
         text="\n".join(message_lines),
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=BACK_KEYBOARDS['teacher']
     )
 
 
@@ -1143,16 +1226,14 @@ async def show_teacher_students(update: Update, context: CallbackContext):
     await query.answer()
     chat_id = update.effective_chat.id
     
-    with Session() as session:
-        teacher = session.query(User).filter_by(chat_id=chat_id, user_type='teacher').first()
-        if not teacher:
-            await query.edit_message_text("❌ Доступно только для преподавателей")
-            return
-        
-        # Получаем уникальных студентов, которые создали задания с именем преподавателя
-        students = session.query(User).join(Task, Task.student_id == User.id).filter(
-            Task.teacher_name.ilike(f"%{teacher.full_name}%")
-        ).distinct().all()
+    teacher = await get_identity(chat_id, 'teacher')
+    if not teacher:
+        await query.edit_message_text("❌ Доступно только для преподавателей")
+        return
+
+    async with AsyncSession() as session:
+        # Получаем уникальных студентов, которые создали задания для преподавателя
+        students = await teacher_students(session, teacher.id)
         
         if not students:
             await query.edit_message_text("Нет студентов, загрузивших задания с вашим именем")
@@ -1162,11 +1243,9 @@ async def show_teacher_students(update: Update, context: CallbackContext):
         for student in students:
             message.append(f"- {student.full_name}")
         
-        keyboard = [[InlineKeyboardButton("🔙 В меню", callback_data='back_to_teacher_menu')]]
-        
         await query.edit_message_text(
             text="\n".join(message),
-            reply_markup=InlineKeyboardMarkup(keyboard))
+            reply_markup=BACK_KEYBOARDS['teacher'])
 
 
 
@@ -1176,24 +1255,13 @@ async def show_teacher_helpers(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
 
     # Получаем преподавателя и всех helper’ов, завершивших его задачи
-    with Session() as session:
-        teacher = session.query(User)\
-                         .filter_by(chat_id=chat_id, user_type='teacher')\
-                         .first()
-        if not teacher:
-            await query.edit_message_text("❌ Доступно только для преподавателей")
-            return
+    teacher = await get_identity(chat_id, 'teacher')
+    if not teacher:
+        await query.edit_message_text("❌ Доступно только для преподавателей")
+        return
 
-        helpers = (
-            session.query(User)
-                   .join(Task, Task.helper_id == User.id)
-                   .filter(
-                        Task.teacher_name.ilike(f"%{teacher.full_name}%"),
-                        Task.status == 'completed'
-                   )
-                   .distinct()
-                   .all()
-        )
+    async with AsyncSession() as session:
+        helpers = await teacher_helpers(session, teacher.id)
 
     # 1) Если помощников нет — показываем одно сообщение с кнопкой возврата
     if not helpers:
@@ -1202,9 +1270,7 @@ async def show_teacher_helpers(update: Update, context: CallbackContext):
                 "Нет помогающих студентов по вашим заданиям.\n\n"
                 "Нажмите кнопку ниже, чтобы вернуться в меню."
             ),
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔙 В меню", callback_data="back_to_teacher_menu")
-            ]])
+            reply_markup=BACK_KEYBOARDS['teacher']
         )
         return
 
@@ -1215,15 +1281,128 @@ async def show_teacher_helpers(update: Update, context: CallbackContext):
             f"{i}. {helper.full_name} — ⭐ {helper.rating:.1f} (выполнено: {helper.completed_tasks})"
         )
 
-    # 3) Кнопка возврата
-    keyboard = [
-        [InlineKeyboardButton("🔙 В меню", callback_data="back_to_teacher_menu")]
-    ]
-
-    # 4) Редактируем сообщение одним вызовом
+    # 3) Редактируем сообщение одним вызовом, кнопка возврата — готовая
     await query.edit_message_text(
         text="\n".join(message_lines),
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=BACK_KEYBOARDS['teacher']
+    )
+
+
+async def export_teacher_tasks(update: Update, context: CallbackContext):
+    """/export и кнопка меню: CSV со всеми заданиями преподавателя."""
+    if update.callback_query:
+        await update.callback_query.answer()
+    chat_id = update.effective_chat.id
+
+    teacher = await get_identity(chat_id, 'teacher')
+    if not teacher:
+        await context.bot.send_message(chat_id, "❌ Доступно только для преподавателей")
+        return
+
+    # Синхронная выгрузка пачками в отдельном потоке, чтобы не блокировать цикл событий
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"tasks_{datetime.now():%Y%m%d}.csv")
+        count = await asyncio.to_thread(export_rows, teacher_tasks_export(teacher.id), path)
+        if not count:
+            await context.bot.send_message(chat_id, "📭 Пока нет заданий с вашим именем")
+            return
+        with open(path, 'rb') as f:
+            await context.bot.send_document(
+                chat_id, document=f, filename=os.path.basename(path),
+                caption=f"📥 Ваши задания: {count}"
+            )
+
+
+def median_completion_hours(histogram):
+    """Медиана времени выполнения по гистограмме {корзина: заданий}, часы.
+
+    Внутри корзины время считаем распределённым равномерно. Если медиана
+    попала в последнюю, открытую корзину, возвращаем её нижнюю границу.
+    """
+    total = sum(histogram.values())
+    if not total:
+        return None
+    half, seen = total / 2, 0
+    for bucket in range(len(COMPLETION_BUCKETS) + 1):
+        count = histogram.get(bucket, 0)
+        if count and seen + count >= half:
+            low = COMPLETION_BUCKETS[bucket - 1] if bucket else 0
+            if bucket == len(COMPLETION_BUCKETS):
+                return low
+            return low + (COMPLETION_BUCKETS[bucket] - low) * (half - seen) / count
+        seen += count
+
+
+def format_hours(hours):
+    if hours < 1:
+        return f"{round(hours * 60)} мин"
+    if hours < 48:
+        return f"{hours:.1f} ч"
+    return f"{hours / 24:.1f} дн"
+
+
+async def show_teacher_dashboard(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    chat_id = update.effective_chat.id
+
+    teacher = await get_identity(chat_id, 'teacher')
+    if not teacher:
+        await query.edit_message_text("❌ Доступно только для преподавателей")
+        return
+
+    # Только сводные таблицы: стоимость не растёт вместе с историей заданий
+    async with AsyncSession() as session:
+        dashboard = await teacher_dashboard(session, teacher.id)
+
+    rows = [row for row in dashboard.subjects
+            if row.new_tasks or row.in_progress_tasks or row.completed_tasks or row.expired_tasks]
+    if not rows:
+        await query.edit_message_text(
+            "📭 Пока нет заданий с вашим именем",
+            reply_markup=BACK_KEYBOARDS['teacher']
+        )
+        return
+
+    names = {}
+    for row in rows:
+        subject = await subject_registry.get(row.subject_id)
+        names[row.subject_id] = subject.name if subject else "—"
+    rows.sort(key=lambda row: names[row.subject_id])
+
+    lines = ["📊 <b>Статистика по вашим заданиям</b>\n"]
+    for row in rows:
+        line = (
+            f"<b>{html.escape(names[row.subject_id])}</b>: "
+            f"{STATUS_ICONS['new']} {row.new_tasks} · {STATUS_ICONS['in_progress']} {row.in_progress_tasks} · "
+            f"{STATUS_ICONS['completed']} {row.completed_tasks} · {STATUS_ICONS['expired']} {row.expired_tasks}"
+        )
+        if row.rating_count:
+            line += f" · ⭐ {row.rating_sum / row.rating_count:.1f}"
+        lines.append(line)
+
+    total = sum(row.new_tasks + row.in_progress_tasks + row.completed_tasks + row.expired_tasks for row in rows)
+    rating_sum = sum(row.rating_sum for row in rows)
+    rating_count = sum(row.rating_count for row in rows)
+    lines.append(f"\n📋 Всего заданий: {total}")
+    median = median_completion_hours(dashboard.histogram)
+    if median is not None:
+        lines.append(f"⏱ Медиана времени выполнения: ~{format_hours(median)}")
+    if rating_count:
+        lines.append(f"⭐ Средняя оценка: {rating_sum / rating_count:.2f} (оценок: {rating_count})")
+
+    if dashboard.helpers:
+        lines.append("\n🏆 <b>Лучшие помощники:</b>")
+        for i, (full_name, completed, helper_sum, helper_count) in enumerate(dashboard.helpers, 1):
+            line = f"{i}. {html.escape(full_name)} — выполнено: {completed}"
+            if helper_count:
+                line += f", ⭐ {helper_sum / helper_count:.1f}"
+            lines.append(line)
+
+    await query.edit_message_text(
+        "\n".join(lines),
+        parse_mode='HTML',
+        reply_markup=BACK_KEYBOARDS['teacher']
     )
 
 
@@ -0,0 +1,60 @@
+"""Снимок рейтинга помощников для экрана «Рейтинг помощников».
+
+Рейтинг меняется только при оценке задания, поэтому верхние N строк
+рендерятся один раз и отдаются из памяти до следующего события
+оценки или истечения TTL.
+"""
+import asyncio
+import time
+from database import AsyncSession
+from queries import top_helpers, helper_position
+
+
+class Leaderboard:
+    def __init__(self, size=20, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._text = None
+        self._expires_at = 0.0
+        # Растёт при каждой инвалидации: снимок, запрошенный до неё, не считается свежим
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+        self._expires_at = 0.0
+
+    async def text(self):
+        """Готовый текст топ-N или None, если помощников ещё нет."""
+        if self._expires_at < time.monotonic():
+            async with self._lock:
+                # Пока ждали блокировку, снимок мог обновить другой обработчик
+                if self._expires_at < time.monotonic():
+                    await self._refresh()
+        return self._text
+
+    async def _refresh(self):
+        generation = self._generation
+        async with AsyncSession() as session:
+            helpers = await top_helpers(session, self.size)
+
+        if helpers:
+            message = [f"🏆 Рейтинг помощников (топ-{self.size}):\n"]
+            for i, helper in enumerate(helpers, 1):
+                message.append(
+                    f"{i}. {helper.full_name} - ⭐ {helper.rating:.1f} "
+                    f"(выполнено заданий: {helper.completed_tasks})"
+                )
+            self._text = "\n".join(message)
+        else:
+            self._text = None
+        # Если оценку поставили, пока шёл запрос, следующий вызов перечитает рейтинг
+        if generation == self._generation:
+            self._expires_at = time.monotonic() + self.ttl
+
+    async def position(self, helper_id):
+        async with AsyncSession() as session:
+            return await helper_position(session, helper_id)
+
+
+leaderboard = Leaderboard()
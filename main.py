@@ -1,14 +1,27 @@
+import asyncio
+import contextlib
+import contextvars
 import logging
+from collections import deque
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     ConversationHandler,
     MessageHandler,
     filters,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    InlineQueryHandler
 )
 from handlers import *
-from database import init_db
+from database import init_db, async_engine
+from notifications import notifications
+from deadlines import deadlines
+from archive import archiver
+from migrations import online_migrations
+from subjects import subject_registry
+from metrics import InstrumentedRequest, instrument_handlers, reporter
+from persistence import DatabasePersistence
 from dotenv import load_dotenv
 import os
 
@@ -16,6 +29,18 @@ import os
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Режим получения апдейтов: 'polling' (по умолчанию) или 'webhook'
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")              # публичный https-адрес, например https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Сколько апдейтов обрабатывается одновременно (апдейты одного чата — всё равно по очереди)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 16))
+# Как часто (в секундах) черновики и состояния диалогов сохраняются в базу
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", 30))
+
 # Настройка логгирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -23,13 +48,94 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main() -> None:
-    # Инициализация базы данных
-    init_db()
-    
-    # Создание приложения
-    application = ApplicationBuilder().token(TOKEN).build()
-    
+class ChatOrderedApplication(Application):
+    """Обрабатывает апдейты разных чатов параллельно, а одного чата — строго по порядку.
+
+    Так состояние ConversationHandler и context.user_data не гоняются между
+    двумя быстрыми сообщениями одного пользователя.
+
+    У каждого активного чата своя очередь и одна задача-обработчик. Слот общего
+    лимита concurrent_updates получает только апдейт, который обрабатывается
+    прямо сейчас: очередь одного чата (альбом из 10 фото, быстрые нажатия)
+    не занимает слоты и не тормозит остальные чаты.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._update_slots = asyncio.BoundedSemaphore(self.concurrent_updates or 1)
+        # PTB 20.3 берёт свой семафор до вызова process_update, то есть ещё до
+        # очереди чата; лимит соблюдаем сами в _drain_chat
+        self._concurrent_updates_sem = contextlib.nullcontext()
+        self._chat_queues = {}      # chat_id -> deque[(update, future, context)]
+        self._chat_workers = set()
+
+    async def process_update(self, update: object) -> None:
+        chat = getattr(update, 'effective_chat', None)
+        if chat is None:
+            async with self._update_slots:
+                await super().process_update(update)
+            return
+
+        done = asyncio.get_running_loop().create_future()
+        queue = self._chat_queues.get(chat.id)
+        if queue is None:
+            queue = self._chat_queues[chat.id] = deque()
+            worker = asyncio.create_task(self._drain_chat(chat.id, queue))
+            self._chat_workers.add(worker)
+            worker.add_done_callback(self._chat_workers.discard)
+        # Контекстные переменные (метрики, счётчики бенчмарка) — те же, что у вызывающего
+        queue.append((update, done, contextvars.copy_context()))
+        await done
+
+    async def _drain_chat(self, chat_id, queue):
+        """Обрабатывает апдейты чата по одному, пока очередь не опустеет."""
+        try:
+            while queue:
+                update, done, context = queue[0]
+                try:
+                    async with self._update_slots:
+                        await context.run(asyncio.ensure_future, super().process_update(update))
+                except Exception as exc:
+                    if not done.done():
+                        done.set_exception(exc)
+                else:
+                    if not done.done():
+                        done.set_result(None)
+                queue.popleft()
+        finally:
+            del self._chat_queues[chat_id]
+            # Если задачу отменили посреди очереди, не оставляем ожидающих навсегда
+            for _, done, _ in queue:
+                done.cancel()
+
+async def post_init(application) -> None:
+    # Запускаем фоновую доставку уведомлений
+    notifications.start(application.bot)
+    # Справочник предметов держим в памяти
+    await subject_registry.load()
+    # Напоминания о дедлайнах и снятие просроченных заданий
+    deadlines.start()
+    # Перенос старых завершённых заданий в архив
+    archiver.start()
+    # Сводка метрик в лог и /metrics на METRICS_PORT
+    await reporter.start()
+    # Фоновые миграции: заполнение новых колонок короткими пачками
+    online_migrations.start()
+
+async def post_stop(application) -> None:
+    # Досылаем уведомления, пока бот ещё инициализирован
+    await online_migrations.stop()
+    await deadlines.stop()
+    await archiver.stop()
+    await reporter.stop()
+    await notifications.stop()
+
+async def post_shutdown(application) -> None:
+    # Закрываем соединения асинхронного движка при остановке бота
+    await async_engine.dispose()
+
+def add_handlers(application) -> None:
+    """Регистрирует все обработчики бота (используется и бенчмарком)."""
     # Обработчик регистрации
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -40,7 +146,9 @@ def main() -> None:
             ],
         },
         fallbacks=[CommandHandler('cancel', cancel)], 
-        per_chat=True
+        per_chat=True,
+        name='registration',
+        persistent=True
     )
     
     # Обработчик создания задания (обратите внимание на allow_reentry=True)
@@ -69,7 +177,11 @@ def main() -> None:
                 CommandHandler('cancel', cancel)
             ],
             CREATE_TASK_ATTACHMENT: [
-                MessageHandler(filters.PHOTO | filters.Document.ALL, task_attachment_received),
+                MessageHandler(
+                    filters.PHOTO | filters.VIDEO | filters.AUDIO | filters.Document.ALL,
+                    task_attachment_received
+                ),
+                CommandHandler('done', finish_task_creation),
                 CommandHandler('skip', skip_attachment),
                 CommandHandler('cancel', cancel)
             ]
@@ -80,6 +192,8 @@ def main() -> None:
             CallbackQueryHandler(back_to_student_menu, pattern='^back_to_student_menu$')
         ],
         per_chat=True,
+        name='task_creation',
+        persistent=True,
         allow_reentry=True  # Позволяет повторно запускать диалог создания задания
     )
     
@@ -89,14 +203,18 @@ def main() -> None:
         states={
             SEND_SOLUTION: [
                 MessageHandler(
-                    filters.TEXT | filters.PHOTO | filters.Document.ALL,
+                    (filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.VIDEO
+                    | filters.AUDIO | filters.Document.ALL,
                     receive_solution
                 ),
+                CommandHandler('done', finish_solution),
                 CommandHandler('cancel', cancel_solution)
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel_solution)],
         per_chat=True,
+        name='solution',
+        persistent=True,
         allow_reentry=True
     )
     
@@ -110,7 +228,7 @@ def main() -> None:
     application.add_handler(MessageHandler(filters.Regex(r'^Меню$'), menu_handler))
     
     # Обработчики для студента
-    application.add_handler(CallbackQueryHandler(show_student_tasks, pattern='^my_tasks$'))
+    application.add_handler(CallbackQueryHandler(show_student_tasks, pattern='^my_tasks'))
     application.add_handler(CallbackQueryHandler(show_helper_rating, pattern='^helper_rating$'))
     application.add_handler(CallbackQueryHandler(delete_task, pattern='^delete_task_'))
     application.add_handler(CallbackQueryHandler(rate_task, pattern='^rate_task_'))
@@ -123,8 +241,14 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(abandon_task, pattern='^abandon_task_'))
     application.add_handler(CallbackQueryHandler(helper_menu, pattern='^refresh_helper_menu$'))
     application.add_handler(CallbackQueryHandler(helper_menu, pattern='^back_to_helper_menu$'))
-    application.add_handler(CallbackQueryHandler(show_helper_tasks, pattern='^helper_my_tasks$'))
+    application.add_handler(CallbackQueryHandler(show_helper_tasks, pattern='^helper_my_tasks'))
+    application.add_handler(CallbackQueryHandler(show_archive, pattern='^archive'))
     application.add_handler(CallbackQueryHandler(show_available_tasks, pattern='^available_tasks$'))
+    application.add_handler(CommandHandler('search', search_tasks))
+    application.add_handler(CallbackQueryHandler(search_page, pattern='^search_page_'))
+    application.add_handler(CallbackQueryHandler(search_help, pattern='^search_help$'))
+    # Inline-режим (@бот запрос); его нужно включить у @BotFather командой /setinline
+    application.add_handler(InlineQueryHandler(inline_tasks))
     
     # Обработчики для преподавателя
     application.add_handler(CallbackQueryHandler(teacher_menu, pattern='^refresh_teacher_menu$'))
@@ -132,13 +256,51 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(show_teacher_student_tasks, pattern='^teacher_student_tasks$'))
     application.add_handler(CallbackQueryHandler(show_teacher_students, pattern='^teacher_students$'))
     application.add_handler(CallbackQueryHandler(show_teacher_helpers, pattern='^teacher_helpers$'))
+    application.add_handler(CallbackQueryHandler(show_teacher_dashboard, pattern='^teacher_dashboard$'))
+    application.add_handler(CallbackQueryHandler(export_teacher_tasks, pattern='^teacher_export$'))
+    application.add_handler(CommandHandler('export', export_teacher_tasks))
     
     application.add_handler(CallbackQueryHandler(filter_tasks, pattern=r'^filter_tasks_'))
     application.add_handler(CallbackQueryHandler(choose_task,    pattern=r'^choose_task_'))
     application.add_handler(CallbackQueryHandler(view_my_task,  pattern=r'^view_my_task_'))
     application.add_handler(CallbackQueryHandler(info_task, pattern=r'^info_task_'))
+
+    # Время, SQL-запросы и вызовы Bot API по каждому обработчику
+    instrument_handlers(application)
+
+def main() -> None:
+    # Инициализация базы данных; долгие заполнения колонок идут в фоне после старта
+    init_db(online=False)
+    
+    # Создание приложения
+    application = ApplicationBuilder()\
+        .token(TOKEN)\
+        .request(InstrumentedRequest(connection_pool_size=256))\
+        .application_class(ChatOrderedApplication)\
+        .concurrent_updates(CONCURRENT_UPDATES)\
+        .persistence(DatabasePersistence(update_interval=PERSISTENCE_INTERVAL))\
+        .post_init(post_init)\
+        .post_stop(post_stop)\
+        .post_shutdown(post_shutdown)\
+        .build()
+    
+    add_handlers(application)
+
     # Запуск бота
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            raise RuntimeError("Для режима webhook нужно задать WEBHOOK_URL")
+        # Локальный HTTP-сервер; TLS обычно завершает обратный прокси
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=CONCURRENT_UPDATES,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
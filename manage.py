@@ -0,0 +1,106 @@
+"""Служебные команды для базы данных бота.
+
+    python manage.py init-db
+    python manage.py migrate [--list]
+    python manage.py rebuild-ratings
+    python manage.py merge-subjects                 # только показать похожие предметы
+    python manage.py merge-subjects --apply 7:3     # перенести задания предмета 7 в 3 и удалить 7
+    python manage.py rebuild-teacher-stats
+    python manage.py export tasks tasks.csv         # или tasks.parquet (нужен pyarrow)
+    python manage.py import tasks tasks.parquet
+"""
+import argparse
+import time
+from database import init_db, rebuild_rating_aggregates, find_duplicate_subjects, merge_subjects, rebuild_teacher_stats
+from transfer import TABLES, export_table, import_table
+from migrations import MIGRATIONS, applied_versions, migrate
+
+
+def cmd_init_db(args):
+    init_db()
+
+
+def cmd_migrate(args):
+    if args.list:
+        applied = applied_versions()
+        for m in sorted(MIGRATIONS, key=lambda m: m.version):
+            mark = 'x' if m.version in applied else ' '
+            print(f"[{mark}] {m.version:>3} {m.name}{' (online)' if m.online else ''}")
+        return
+    done = migrate()
+    for m in done:
+        print(f"Applied {m.version}: {m.name}")
+    print(f"{len(done)} migrations applied")
+
+
+def cmd_rebuild_ratings(args):
+    count = rebuild_rating_aggregates()
+    print(f"Rating aggregates rebuilt for {count} helpers")
+
+
+def cmd_merge_subjects(args):
+    if args.apply:
+        pairs = [tuple(int(part) for part in pair.split(':', 1)) for pair in args.apply]
+        count = merge_subjects(pairs)
+        print(f"Merged {count} duplicate subjects")
+        return
+    pairs = find_duplicate_subjects()
+    for (duplicate_id, duplicate), (target_id, target) in pairs:
+        print(f"{duplicate_id}:{target_id}\t{duplicate!r} -> {target!r}")
+    print(f"{len(pairs)} candidate pairs; review them and rerun with --apply DUPLICATE:TARGET ...")
+
+
+def cmd_rebuild_teacher_stats(args):
+    count = rebuild_teacher_stats()
+    print(f"Statistics rebuilt for {count} teachers")
+
+
+def cmd_export(args):
+    started = time.perf_counter()
+    count = export_table(args.table, args.path, args.format, args.batch_size)
+    print(f"Exported {count} {args.table} rows to {args.path} in {time.perf_counter() - started:.1f}s")
+
+
+def cmd_import(args):
+    started = time.perf_counter()
+    count = import_table(args.table, args.path, args.format, args.batch_size)
+    print(f"Imported {count} {args.table} rows from {args.path} in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StudentHelper maintenance commands")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('init-db', help="create tables and apply migrations").set_defaults(func=cmd_init_db)
+    command = commands.add_parser('migrate', help="apply pending migrations, including batched backfills")
+    command.add_argument('--list', action='store_true', help="only show applied and pending migrations")
+    command.set_defaults(func=cmd_migrate)
+    commands.add_parser(
+        'rebuild-ratings', help="recompute helper rating aggregates from tasks"
+    ).set_defaults(func=cmd_rebuild_ratings)
+    command = commands.add_parser(
+        'merge-subjects', help="list subjects whose names differ only by case, punctuation or a typo"
+    )
+    command.add_argument('--apply', nargs='+', metavar='DUPLICATE:TARGET',
+                         help="merge the given subject ids instead of listing candidates")
+    command.set_defaults(func=cmd_merge_subjects)
+    commands.add_parser(
+        'rebuild-teacher-stats', help="recompute the teacher dashboard summary tables from tasks"
+    ).set_defaults(func=cmd_rebuild_teacher_stats)
+    for name, func, help_text in [
+        ('export', cmd_export, "stream a table to a CSV or Parquet file"),
+        ('import', cmd_import, "bulk load a table from a CSV or Parquet file"),
+    ]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('table', choices=list(TABLES))
+        command.add_argument('path')
+        command.add_argument('--format', choices=['csv', 'parquet'], help="default: by file extension")
+        command.add_argument('--batch-size', type=int, default=10_000)
+        command.set_defaults(func=func)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Нормализация и нечёткое сравнение имён, которые пользователи вводят вручную."""
+import re
+from difflib import SequenceMatcher
+
+# Порог, начиная с которого имена считаем одним и тем же человеком/предметом
+MATCH_CUTOFF = 0.85
+# Если второй кандидат отстаёт от лучшего меньше чем на столько, имя неоднозначно
+AMBIGUITY_MARGIN = 0.05
+# Опечатку в названии предмета прощаем только в словах не короче этого
+TYPO_MIN_LENGTH = 5
+
+
+def normalize_name(name):
+    """'Сидоров  С.А.' -> 'сидоров с а'"""
+    name = name.lower().replace('ё', 'е')
+    name = re.sub(r'[^\w\s]', ' ', name)
+    return ' '.join(name.split())
+
+
+def _surname_initials(normalized):
+    # 'сидоров сергей александрович' и 'сидоров с а' -> ('сидоров', 'са')
+    words = normalized.split()
+    if not words:
+        return '', ''
+    return words[0], ''.join(word[0] for word in words[1:])
+
+
+def similarity(a, b):
+    """Оценка похожести двух имён от 0 до 1."""
+    na, nb = normalize_name(a), normalize_name(b)
+    if na == nb:
+        return 1.0
+
+    surname_a, initials_a = _surname_initials(na)
+    surname_b, initials_b = _surname_initials(nb)
+    if surname_a == surname_b and initials_a and initials_b \
+            and (initials_a.startswith(initials_b) or initials_b.startswith(initials_a)):
+        return 0.95
+
+    # Разные фамилии — разные люди, как бы похоже они ни писались:
+    # «Сидоров С.А.» и «Сидорова С.А.», «Иванов» и «Иванова М.К.»
+    if surname_a != surname_b:
+        return 0.0
+
+    # «Сидоров» и «Сидоров С.А.»
+    shorter, longer = sorted((na, nb), key=len)
+    if len(shorter) >= 5 and shorter in longer:
+        return 0.9
+
+    return SequenceMatcher(None, na, nb).ratio()
+
+
+def normalize_title(title):
+    """Название предмета без регистра, лишних пробелов, пунктуации и «ё».
+
+    «+» и «#» значимы: «C++» и «C#» — разные предметы.
+    """
+    title = title.lower().replace('ё', 'е')
+    title = re.sub(r'[^\w\s+#]', ' ', title)
+    return ' '.join(title.split())
+
+
+def _one_typo(a, b):
+    """Отличаются ли слова ровно одной буквой: замена, пропуск, лишняя или перестановка соседних."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i, (x, y) in enumerate(zip(a, b)) if x != y]
+        return len(diff) == 1 or (
+            len(diff) == 2 and diff[1] == diff[0] + 1
+            and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+        )
+    shorter, longer = sorted((a, b), key=len)
+    for i in range(len(longer)):
+        if longer[:i] + longer[i + 1:] == shorter:
+            return True
+    return False
+
+
+def spelling_similarity(a, b):
+    """Похожесть названий предметов: 1.0, 0.9 для одной опечатки или 0.
+
+    Совпадением считаются только названия, одинаковые после normalize_title,
+    и названия, где в одном слове из букв (не короче TYPO_MIN_LENGTH)
+    опечатка в одну букву: «Матиматика» — это «Математика». Любое другое
+    отличие — в цифрах, лишнее или другое слово — значит другой предмет:
+    «Физика 1» и «Физика 2», «Физика» и «Физика твёрдого тела».
+    """
+    words_a, words_b = normalize_title(a).split(), normalize_title(b).split()
+    if words_a == words_b:
+        return 1.0
+    if len(words_a) != len(words_b):
+        return 0.0
+    diff = [(x, y) for x, y in zip(words_a, words_b) if x != y]
+    if len(diff) != 1:
+        return 0.0
+    x, y = diff[0]
+    if not (x + y).isalpha() or min(len(x), len(y)) < TYPO_MIN_LENGTH:
+        return 0.0
+    return 0.9 if _one_typo(x, y) else 0.0
+
+
+def best_match(name, candidates, cutoff=MATCH_CUTOFF, scorer=similarity):
+    """Ключ самого похожего кандидата из пар (key, name) или None.
+
+    None и тогда, когда порог проходят несколько кандидатов с почти равной
+    оценкой («Сидоров» при «Сидоров С.А.» и «Сидоров П.П.»): угадывать нельзя.
+    """
+    scored = sorted(
+        ((score, key) for key, candidate in candidates
+         if (score := scorer(name, candidate)) >= cutoff),
+        key=lambda item: item[0], reverse=True
+    )
+    if not scored:
+        return None
+    if len(scored) > 1 and scored[0][0] - scored[1][0] < AMBIGUITY_MARGIN:
+        return None
+    return scored[0][1]
@@ -0,0 +1,254 @@
+"""Метрики обработчиков бота.
+
+Каждый зарегистрированный обработчик оборачивается в instrument_handlers:
+на время вызова в contextvar кладётся счётчик, в который события движка
+SQLAlchemy добавляют число и время SQL-запросов, а InstrumentedRequest —
+время вызовов Bot API. Итоги доступны в формате Prometheus
+(METRICS_PORT) и периодической сводкой в лог.
+"""
+import asyncio
+import functools
+import logging
+import os
+from contextvars import ContextVar
+from time import perf_counter
+from sqlalchemy import event
+from telegram.ext import ConversationHandler, CallbackQueryHandler, CommandHandler
+from telegram.request import HTTPXRequest
+from database import async_engine
+from notifications import notifications
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы времени обработки, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_current = ContextVar('handler_sample', default=None)
+
+
+class Sample:
+    __slots__ = ('sql_count', 'db_time', 'api_calls', 'api_time')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.db_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+
+
+class HandlerStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wall_time = 0.0
+        self.db_time = 0.0
+        self.sql_count = 0
+        self.api_time = 0.0
+        self.api_calls = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def record(self, seconds, sample, failed):
+        self.count += 1
+        self.errors += failed
+        self.wall_time += seconds
+        self.db_time += sample.db_time
+        self.sql_count += sample.sql_count
+        self.api_time += sample.api_time
+        self.api_calls += sample.api_calls
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+# (обработчик, паттерн) -> HandlerStats
+stats = {}
+
+
+@event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    # Время старта храним в контексте выполнения, а не в conn.info: контекст
+    # живёт ровно один запрос, поэтому после ошибки в соединении ничего не остаётся
+    if _current.get() is not None and context is not None:
+        context._metrics_started = perf_counter()
+
+
+def _finish_query(context):
+    sample = _current.get()
+    started = getattr(context, '_metrics_started', None)
+    if sample is not None and started is not None:
+        del context._metrics_started
+        sample.sql_count += 1
+        sample.db_time += perf_counter() - started
+
+
+@event.listens_for(async_engine.sync_engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    _finish_query(context)
+
+
+@event.listens_for(async_engine.sync_engine, 'handle_error')
+def _query_failed(exception_context):
+    # Упавший запрос тоже занимал базу — засчитываем его время обработчику
+    _finish_query(exception_context.execution_context)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, засчитывающий время вызовов Bot API текущему обработчику."""
+
+    async def do_request(self, *args, **kwargs):
+        sample = _current.get()
+        if sample is None:
+            return await super().do_request(*args, **kwargs)
+        started = perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            sample.api_calls += 1
+            sample.api_time += perf_counter() - started
+
+
+def _timed(callback, key):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        sample = Sample()
+        token = _current.set(sample)
+        started = perf_counter()
+        failed = False
+        try:
+            return await callback(update, context)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _current.reset(token)
+            stats.setdefault(key, HandlerStats()).record(perf_counter() - started, sample, failed)
+    return wrapper
+
+
+def _label(handler):
+    pattern = ''
+    if isinstance(handler, CallbackQueryHandler) and handler.pattern is not None:
+        pattern = getattr(handler.pattern, 'pattern', str(handler.pattern))
+    elif isinstance(handler, CommandHandler):
+        pattern = '/' + '|/'.join(sorted(handler.commands))
+    return handler.callback.__name__, pattern
+
+
+def _wrap(handler):
+    if isinstance(handler, ConversationHandler):
+        for child in handler.entry_points + handler.fallbacks:
+            _wrap(child)
+        for children in handler.states.values():
+            for child in children:
+                _wrap(child)
+    else:
+        handler.callback = _timed(handler.callback, _label(handler))
+
+
+def instrument_handlers(application):
+    """Оборачивает все обработчики приложения (в том числе внутри диалогов)."""
+    for group in application.handlers.values():
+        for handler in group:
+            _wrap(handler)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_prometheus():
+    # Строки одного семейства метрик в текстовом формате должны идти подряд
+    rows = [(f'handler="{name}",pattern="{_escape(pattern)}"', s) for (name, pattern), s in sorted(stats.items())]
+    lines = ['# TYPE student_helper_handler_seconds histogram']
+    for labels, s in rows:
+        for bound, bucket in zip(BUCKETS, s.buckets):
+            lines.append(f'student_helper_handler_seconds_bucket{{{labels},le="{bound}"}} {bucket}')
+        lines.append(f'student_helper_handler_seconds_bucket{{{labels},le="+Inf"}} {s.count}')
+        lines.append(f'student_helper_handler_seconds_sum{{{labels}}} {s.wall_time:.6f}')
+        lines.append(f'student_helper_handler_seconds_count{{{labels}}} {s.count}')
+    for metric, attr in [
+        ('db_seconds_total', 'db_time'),
+        ('sql_statements_total', 'sql_count'),
+        ('api_seconds_total', 'api_time'),
+        ('api_calls_total', 'api_calls'),
+        ('errors_total', 'errors'),
+    ]:
+        lines.append(f'# TYPE student_helper_handler_{metric} counter')
+        for labels, s in rows:
+            lines.append(f'student_helper_handler_{metric}{{{labels}}} {getattr(s, attr):g}')
+    lines.append('# TYPE student_helper_notifications_total counter')
+    for name, value in sorted(notifications.metrics.items()):
+        lines.append(f'student_helper_notifications_total{{event="{name}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """Текстовая сводка: самые затратные по суммарному времени обработчики сверху."""
+    lines = []
+    for (name, pattern), s in sorted(stats.items(), key=lambda item: -item[1].wall_time):
+        n = s.count
+        lines.append(
+            f"{name} {pattern}: n={n} avg={s.wall_time / n * 1000:.1f}ms "
+            f"db={s.db_time / n * 1000:.1f}ms sql/upd={s.sql_count / n:.1f} "
+            f"api={s.api_time / n * 1000:.1f}ms errors={s.errors}"
+        )
+    if notifications.metrics:
+        lines.append("notifications: " + ", ".join(f"{k}={v}" for k, v in sorted(notifications.metrics.items())))
+    return "\n".join(lines)
+
+
+class MetricsReporter:
+    """Периодическая сводка в лог и необязательный HTTP-эндпоинт /metrics."""
+
+    def __init__(self, log_interval=300, port=None, host='0.0.0.0'):
+        self.log_interval = log_interval
+        self.port = port
+        self.host = host
+        self._task = None
+        self._server = None
+
+    async def start(self):
+        if self.log_interval:
+            self._task = asyncio.create_task(self._log_loop())
+        if self.port:
+            self._server = await asyncio.start_server(self._serve, self.host, self.port)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _log_loop(self):
+        while True:
+            await asyncio.sleep(self.log_interval)
+            text = summary()
+            if text:
+                logger.info("Метрики обработчиков:\n%s", text)
+
+    async def _serve(self, reader, writer):
+        # Минимальный HTTP: на любой запрос отдаём метрики
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = render_prometheus().encode()
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/plain; version=0.0.4\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                b'Connection: close\r\n\r\n' + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+reporter = MetricsReporter(
+    log_interval=int(os.getenv('METRICS_LOG_INTERVAL', 300)),
+    port=int(os.getenv('METRICS_PORT', 0)) or None,
+)
@@ -0,0 +1,396 @@
+"""Версионные миграции схемы базы.
+
+create_all создаёт только недостающие таблицы и не меняет существующие,
+поэтому всё, что меняет уже созданные таблицы (колонки, индексы,
+заполнение новых колонок), оформляется здесь миграцией с номером.
+Применённые номера записываются в schema_versions.
+
+Базы, созданные до появления миграций, могут уже содержать часть этих
+изменений, поэтому каждая миграция идемпотентна.
+
+Миграции с online=True не нужны коду бота для работы: main.py запускает
+их в фоне уже после старта, а backfill обновляет строки короткими
+транзакциями по batch_size, не держа блокировку записи надолго.
+Остальные выполняются до запуска бота (init_db) или через
+python manage.py migrate. До старта остаются только:
+
+* 1 — ALTER TABLE ADD COLUMN: меняет только схему, без этих колонок
+  не работают модели;
+* 2, 9 — индексы: в PostgreSQL строятся CONCURRENTLY и запись не
+  блокируют, в SQLite построить индекс без блокировки нельзя, а без них
+  экраны бота читают таблицу целиком;
+* 3 — индекс поиска: заполнение и создание триггеров должны пройти в
+  одной транзакции, иначе изменения между ними разойдутся с индексом;
+  в него попадают только открытые задания, их число не растёт с историей.
+
+Пересчёты и переносы данных (4, 5, 7, 8) идут онлайн и идемпотентны: каждая пачка
+пересчитывает свои строки из заданий заново, поэтому изменения, которые
+бот делает параллельно, не теряются, а прерванную миграцию можно
+просто запустить снова.
+
+Пересоздание tasks с AUTOINCREMENT в SQLite (10) тоже идёт онлайн: копия
+заполняется пачками по id, а изменения, сделанные ботом за это время
+(по updated_at), удалённые из tasks строки и замена таблицы — в одной
+последней транзакции. Дольше остальных в ней строятся индексы новой
+таблицы: их имена заняты старой, пока её не удалили. Прерванное
+пересоздание начинается заново.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import inspect, select, update, insert, delete, text, func, case, literal, null, exists, true
+from sqlalchemy.schema import CreateTable
+from database import (
+    Base, engine, Session, User, Task, ArchivedTask, Attachment, SchemaVersion,
+    ensure_search_index, rebuild_teacher_stats, task_history,
+)
+from matching import best_match
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = int(os.getenv('MIGRATION_BATCH_SIZE', 5000))
+# Пауза между пачками, секунды: даёт боту записать свои изменения
+BACKFILL_PAUSE = float(os.getenv('MIGRATION_BATCH_PAUSE', 0.05))
+# Строки, изменённые за столько до начала копирования tasks, переносятся повторно
+REBUILD_MARGIN = timedelta(minutes=1)
+
+Migration = namedtuple('Migration', ['version', 'name', 'apply', 'online'])
+
+MIGRATIONS = []
+
+_interrupted = threading.Event()
+
+
+class MigrationInterrupted(Exception):
+    pass
+
+
+def migration(version, name, online=False):
+    def register(apply):
+        MIGRATIONS.append(Migration(version, name, apply, online))
+        return apply
+    return register
+
+
+# --- Операции для миграций ---
+
+def add_column(column):
+    """ALTER TABLE ... ADD COLUMN, если колонки ещё нет. Возвращает True, если добавлена.
+
+    В SQLite и PostgreSQL 11+ добавление колонки с константным значением
+    по умолчанию меняет только схему и не переписывает таблицу.
+    """
+    table = column.table
+    existing = {c['name'] for c in inspect(engine).get_columns(table.name)}
+    if column.name in existing:
+        return False
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+    if column.server_default is not None:
+        if not column.nullable:
+            ddl += " NOT NULL"
+        ddl += f" DEFAULT {column.server_default.arg}"
+    with engine.begin() as conn:
+        conn.execute(text(ddl))
+    return True
+
+
+def add_index(table, name):
+    """Создаёт индекс модели, если его ещё нет.
+
+    В PostgreSQL — CREATE INDEX CONCURRENTLY, без блокировки записи
+    (такой запрос нельзя выполнять внутри транзакции). В SQLite индекс
+    строится одним запросом, блокировка записи держится на время построения.
+    """
+    index = next(index for index in table.indexes if index.name == name)
+    if engine.dialect.name != 'postgresql':
+        index.create(engine, checkfirst=True)
+        return
+    columns = ", ".join(column.name for column in index.columns)
+    unique = "UNIQUE " if index.unique else ""
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table.name} ({columns})"))
+
+
+def drop_index(table, name):
+    """Удаляет индекс, если он есть (в PostgreSQL — DROP INDEX CONCURRENTLY)."""
+    if name not in {index['name'] for index in inspect(engine).get_indexes(table.name)}:
+        return
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        return
+    on_table = f" ON {table.name}" if engine.dialect.name == 'mysql' else ""
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {name}{on_table}"))
+
+
+def check_interrupted():
+    """Между пачками: остановка бота прерывает online-миграцию."""
+    if _interrupted.is_set():
+        raise MigrationInterrupted
+
+
+def id_batches(table, where, batch_size=None, pause=None):
+    """Условия на диапазоны id по batch_size между минимальным и максимальным id строк where.
+
+    Вызывающий код выполняет каждую пачку в своей транзакции; между пачками
+    — пауза и проверка остановки бота.
+    """
+    batch_size = batch_size or BACKFILL_BATCH
+    pause = BACKFILL_PAUSE if pause is None else pause
+    with engine.connect() as conn:
+        low, high = conn.execute(select(func.min(table.c.id), func.max(table.c.id)).where(where)).first()
+    if low is None:
+        return
+    for start in range(low, high + 1, batch_size):
+        check_interrupted()
+        yield (table.c.id >= start) & (table.c.id < start + batch_size)
+        time.sleep(pause)
+
+
+def backfill(table, values, where, batch_size=None, pause=None):
+    """UPDATE table SET values WHERE where — пачками по диапазонам id.
+
+    Каждая пачка коммитится отдельно, так что прерванный backfill можно
+    просто запустить снова: where должен отбирать только ещё не
+    заполненные строки. Возвращает число обновлённых строк.
+    """
+    updated = 0
+    for batch in id_batches(table, where, batch_size, pause):
+        with engine.begin() as conn:
+            updated += conn.execute(update(table).where(batch, where).values(values)).rowcount
+    return updated
+
+
+# --- Миграции. Номера не меняются и не переиспользуются ---
+# Заполнение данных работает через модели, которым нужны все их колонки,
+# поэтому новые колонки добавляются миграцией раньше, чем их используют.
+
+@migration(1, "колонки, добавленные в модели до появления миграций")
+def _baseline_columns():
+    for column in (
+        User.__table__.c.rating_sum, User.__table__.c.rating_count,
+        Task.__table__.c.teacher_id, Task.__table__.c.reminded_at,
+        Task.__table__.c.updated_at, Task.__table__.c.completed_at,
+    ):
+        add_column(column)
+
+
+@migration(2, "индексы экранов заданий, рейтинга и планировщика дедлайнов")
+def _baseline_indexes():
+    add_index(User.__table__, 'ix_users_type_rating')
+    for name in (
+        'ix_tasks_status_id', 'ix_tasks_status_subject', 'ix_tasks_student_status_id',
+        'ix_tasks_helper_status', 'ix_tasks_teacher_created', 'ix_tasks_teacher_status',
+        'ix_tasks_status_deadline',
+    ):
+        add_index(Task.__table__, name)
+
+
+@migration(3, "полнотекстовый поиск по открытым заданиям")
+def _search_index():
+    ensure_search_index()
+
+
+@migration(4, "пересчёт накопительного рейтинга помощников", online=True)
+def _rating_aggregates():
+    # Один UPDATE на пачку пользователей с подзапросами по ix_tasks_helper_status
+    # и ix_tasks_archive_helper: оценка, поставленная во время пересчёта, не теряется
+    users = User.__table__
+    totals, counts = [], []
+    for model in (Task, ArchivedTask):
+        rated = (model.helper_id == users.c.id, model.status == 'completed', model.rating.isnot(None))
+        totals.append(select(func.coalesce(func.sum(model.rating), 0)).where(*rated).scalar_subquery())
+        counts.append(select(func.count(model.rating)).where(*rated).scalar_subquery())
+    total, count = totals[0] + totals[1], counts[0] + counts[1]
+    backfill(users, {
+        users.c.rating_sum: total,
+        users.c.rating_count: count,
+        users.c.rating: case((count > 0, total * 1.0 / count), else_=0.0),
+    }, true())
+
+
+@migration(5, "привязка старых заданий к зарегистрированным преподавателям", online=True)
+def _teacher_links():
+    with engine.connect() as conn:
+        teachers = conn.execute(select(User.id, User.full_name).filter_by(user_type='teacher')).all()
+        history = task_history('teacher_name', 'teacher_id').c
+        names = conn.scalars(select(history.teacher_name).where(history.teacher_id.is_(None)).distinct()).all()
+    links = {name: teacher for name in names if (teacher := best_match(name, teachers)) is not None}
+    names = sorted(links)
+    for start in range(0, len(names), 500):
+        chunk = {name: links[name] for name in names[start:start + 500]}
+        for table in (Task.__table__, ArchivedTask.__table__):
+            backfill(
+                table, {table.c.teacher_id: case(chunk, value=table.c.teacher_name)},
+                table.c.teacher_id.is_(None) & table.c.teacher_name.in_(list(chunk))
+            )
+
+
+@migration(6, "заполнение tasks.updated_at для старых заданий", online=True)
+def _updated_at():
+    tasks = Task.__table__
+    backfill(tasks, {tasks.c.updated_at: tasks.c.created_at}, tasks.c.updated_at.is_(None))
+
+
+@migration(7, "сводки для статистики преподавателя", online=True)
+def _teacher_stats():
+    # По преподавателю на транзакцию: блокировка записи держится только на его задания
+    with engine.connect() as conn:
+        teachers = conn.scalars(select(User.id).filter_by(user_type='teacher').order_by(User.id)).all()
+    for teacher_id in teachers:
+        check_interrupted()
+        with Session() as session:
+            rebuild_teacher_stats(session, teacher_id)
+            session.commit()
+        time.sleep(BACKFILL_PAUSE)
+
+
+@migration(8, "перенос вложений из tasks.attachment_id/solution_file_id в attachments", online=True)
+def _attachments():
+    # Раньше фото отличали от документа по attachment_name == 'фото'; тип файла
+    # решения не сохранялся, такие файлы считаем документами. Пока перенос
+    # идёт, queries.attachments_by_task берёт ещё не перенесённые из старых колонок
+    for model in (Task, ArchivedTask):
+        for role, file_id, media_type, file_name in (
+            ('task', model.attachment_id,
+             case((model.attachment_name == 'фото', 'photo'), else_='document'),
+             case((model.attachment_name == 'фото', null()), else_=model.attachment_name)),
+            ('solution', model.solution_file_id, literal('document'), null()),
+        ):
+            already = exists().where(Attachment.task_id == model.id, Attachment.role == role)
+            for batch in id_batches(model.__table__, file_id.isnot(None)):
+                with engine.begin() as conn:
+                    conn.execute(insert(Attachment).from_select(
+                        ['task_id', 'role', 'position', 'media_type', 'file_id', 'file_name'],
+                        select(model.id, literal(role), literal(0), media_type, file_id, file_name)
+                            .where(batch, file_id.isnot(None), ~already)
+                    ))
+
+
+@migration(9, "индекс «Моих заданий» студента в порядке keyset-пагинации (status, id)")
+def _student_tasks_index():
+    add_index(Task.__table__, 'ix_tasks_student_status_id')
+    drop_index(Task.__table__, 'ix_tasks_student_status_created')
+
+
+@migration(10, "AUTOINCREMENT для tasks в SQLite: id заданий из архива не выдаются повторно", online=True)
+def _tasks_autoincrement():
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.connect() as conn:
+        ddl = conn.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tasks'"))
+    if 'AUTOINCREMENT' in ddl.upper():
+        return
+    # SQLite не умеет ALTER для AUTOINCREMENT: копия таблицы по модели, затем замена
+    tasks = Task.__table__
+    rebuilt = tasks.to_metadata(Base.metadata, name='tasks_rebuilt')
+    columns = [column.name for column in tasks.columns]
+
+    def copy(where):
+        # OR REPLACE: строку, изменённую после копирования её пачки, перезаписываем
+        return insert(rebuilt).prefix_with('OR REPLACE').from_select(columns, select(tasks).where(where))
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS tasks_rebuilt"))
+            # Индексы создаются при замене: их имена пока заняты индексами tasks
+            conn.execute(CreateTable(rebuilt))
+        # Запас на транзакции бота, которые поставили updated_at раньше, а
+        # зафиксировались уже после копирования своей пачки
+        started = datetime.now() - REBUILD_MARGIN
+        for batch in id_batches(tasks, true()):
+            with engine.begin() as conn:
+                conn.execute(copy(batch))
+        with engine.begin() as conn:
+            # Бот продолжал работать: новые и изменённые с начала копирования
+            # строки (updated_at ставится при каждом изменении) и удалённые
+            # архивацией переносим уже под блокировкой записи
+            conn.execute(delete(rebuilt).where(rebuilt.c.id.not_in(select(tasks.c.id))))
+            conn.execute(copy(tasks.c.updated_at >= started))
+            conn.execute(text("DROP TABLE tasks"))
+            conn.execute(text("ALTER TABLE tasks_rebuilt RENAME TO tasks"))
+            for index in tasks.indexes:
+                index.create(conn)
+            # Счётчик начинаем после всех выданных id, включая архивные
+            last_id = max(
+                conn.scalar(select(func.coalesce(func.max(Task.id), 0))),
+                conn.scalar(select(func.coalesce(func.max(ArchivedTask.id), 0))),
+            )
+            conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'tasks'"))
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('tasks', :seq)"), {'seq': last_id})
+    finally:
+        Base.metadata.remove(rebuilt)
+    # Триггеры поиска удалены вместе со старой таблицей: создаём и заполняем индекс заново
+    ensure_search_index()
+
+
+# --- Запуск ---
+
+def applied_versions():
+    if not inspect(engine).has_table(SchemaVersion.__tablename__):
+        return set()
+    with engine.connect() as conn:
+        return set(conn.scalars(select(SchemaVersion.version)))
+
+
+def pending(online=None):
+    """Ещё не применённые миграции по порядку; online=False/True — только такого вида."""
+    applied = applied_versions()
+    return [
+        m for m in sorted(MIGRATIONS, key=lambda m: m.version)
+        if m.version not in applied and (online is None or m.online == online)
+    ]
+
+
+def migrate(online=True):
+    """Создаёт недостающие таблицы и применяет миграции. Возвращает применённые.
+
+    online=False пропускает фоновые миграции: их потом выполняет OnlineMigrations.
+    """
+    Base.metadata.create_all(engine)
+    done = []
+    for m in pending(None if online else False):
+        logger.info("Миграция %s: %s", m.version, m.name)
+        started = time.perf_counter()
+        m.apply()
+        with engine.begin() as conn:
+            conn.execute(insert(SchemaVersion).values(version=m.version, name=m.name, applied_at=datetime.now()))
+        logger.info("Миграция %s выполнена за %.1f с", m.version, time.perf_counter() - started)
+        done.append(m)
+    return done
+
+
+class OnlineMigrations:
+    """Фоновый прогон online-миграций в отдельном потоке после запуска бота."""
+
+    def __init__(self):
+        self._task = None
+
+    def start(self):
+        if pending(online=True):
+            _interrupted.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            await asyncio.to_thread(migrate)
+        except MigrationInterrupted:
+            logger.info("Фоновые миграции прерваны остановкой бота, продолжатся при следующем запуске")
+        except Exception:
+            logger.exception("Ошибка фоновой миграции")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Поток нельзя отменить: просим backfill остановиться после текущей пачки
+        _interrupted.set()
+        await self._task
+        self._task = None
+
+
+online_migrations = OnlineMigrations()
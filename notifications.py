@@ -0,0 +1,142 @@
+"""Фоновая доставка уведомлений другим пользователям.
+
+Обработчики только ставят сообщения в очередь, а отправкой занимаются
+воркеры: сообщения одного чата уходят строго по порядку, общий темп
+и темп на чат ограничены, а RetryAfter и сетевые сбои повторяются
+с задержкой.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from telegram.error import RetryAfter, BadRequest, NetworkError, TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationQueue:
+    def __init__(self, global_rate=25, chat_interval=1.0, workers=4, max_retries=5):
+        # Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду на чат
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.metrics = Counter()
+
+        self._bot = None
+        self._pending = {}          # chat_id -> deque[(method, kwargs, attempt)]
+        self._last_sent = {}        # chat_id -> время последней отправки
+        self._ready = None          # очередь chat_id, готовых к отправке
+        self._tasks = []
+        self._next_slot = 0.0
+        self._slot_lock = None
+
+    def start(self, bot):
+        self._bot = bot
+        self._ready = asyncio.Queue()
+        self._slot_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        # Сообщения, поставленные до запуска, отправляем сразу
+        for chat_id in self._pending:
+            self._ready.put_nowait(chat_id)
+
+    async def stop(self, timeout=5.0):
+        """Даёт очереди дослать сообщения и останавливает воркеров."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pending:
+            dropped = sum(len(items) for items in self._pending.values())
+            self.metrics['dropped'] += dropped
+            logger.warning("Не доставлено уведомлений при остановке: %s", dropped)
+
+    def enqueue(self, chat_id, method='send_message', **kwargs):
+        """Ставит вызов bot.<method>(chat_id=..., **kwargs) в очередь чата."""
+        self.metrics['enqueued'] += 1
+        items = self._pending.get(chat_id)
+        if items is None:
+            items = self._pending[chat_id] = deque()
+            if self._ready is not None:
+                self._ready.put_nowait(chat_id)
+        items.append((method, kwargs, 0))
+
+    def _schedule(self, chat_id, delay):
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    async def _acquire_slot(self):
+        # Общий лимит: не чаще global_rate отправок в секунду
+        async with self._slot_lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + 1 / self.global_rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            items = self._pending.get(chat_id)
+            if not items:
+                continue
+
+            # Лимит на чат: переносим чат, а не блокируем воркера
+            wait = self._last_sent.get(chat_id, 0) + self.chat_interval - time.monotonic()
+            if wait > 0:
+                self._schedule(chat_id, wait)
+                continue
+
+            await self._acquire_slot()
+            method, kwargs, attempt = items[0]
+            delay = 0
+            try:
+                await getattr(self._bot, method)(chat_id=chat_id, **kwargs)
+                self.metrics['sent'] += 1
+                items.popleft()
+            except RetryAfter as e:
+                # Флуд-контроль действует на весь бот: сдвигаем и общий слот
+                self.metrics['retry_after'] += 1
+                delay = e.retry_after
+                self._next_slot = max(self._next_slot, time.monotonic() + delay)
+                items[0] = (method, kwargs, attempt + 1)
+            except BadRequest as e:
+                # BadRequest наследует NetworkError, но повтор тут бесполезен
+                logger.error("Уведомление для %s отклонено: %s", chat_id, e)
+                self.metrics['failed'] += 1
+                items.popleft()
+            except NetworkError as e:
+                if attempt + 1 >= self.max_retries:
+                    logger.error("Уведомление для %s не доставлено: %s", chat_id, e)
+                    self.metrics['failed'] += 1
+                    items.popleft()
+                else:
+                    self.metrics['retried'] += 1
+                    delay = 2 ** attempt
+                    items[0] = (method, kwargs, attempt + 1)
+            except TelegramError as e:
+                # Например, пользователь заблокировал бота — повтор не поможет
+                logger.error("Уведомление для %s отклонено: %s", chat_id, e)
+                self.metrics['failed'] += 1
+                items.popleft()
+            except Exception:
+                logger.exception("Ошибка отправки уведомления для %s", chat_id)
+                self.metrics['failed'] += 1
+                items.popleft()
+            self._last_sent[chat_id] = now = time.monotonic()
+
+            if items:
+                self._schedule(chat_id, max(delay, self.chat_interval))
+            else:
+                del self._pending[chat_id]
+            if len(self._last_sent) > 10000:
+                cutoff = now - self.chat_interval
+                self._last_sent = {k: v for k, v in self._last_sent.items() if v > cutoff}
+
+
+notifications = NotificationQueue()
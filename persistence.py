@@ -0,0 +1,131 @@
+"""Хранение user_data, chat_data и состояний диалогов в базе бота.
+
+PTB раз в update_interval отдаёт изменившиеся данные; мы только запоминаем
+их в буфере и чуть позже записываем весь накопленный пакет одной
+транзакцией. Так обычное сообщение не ждёт записи в базу, а перезапуск
+не теряет незаконченные черновики заданий.
+"""
+import asyncio
+import json
+import logging
+import pickle
+from datetime import datetime
+from sqlalchemy import select, delete, insert, tuple_
+from telegram.ext import BasePersistence, PersistenceInput
+from database import AsyncSession, PersistentData
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = 'user_data'
+CHAT_DATA = 'chat_data'
+CONVERSATION = 'conversation:'
+
+
+class DatabasePersistence(BasePersistence):
+    def __init__(self, update_interval=30, write_delay=1.0):
+        # bot_data и callback_data бот не использует
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.write_delay = write_delay
+        self._dirty = {}            # (kind, key) -> pickle или None для удаления
+        self._write_task = None
+        self._write_lock = asyncio.Lock()
+
+    async def _load(self, kind):
+        async with AsyncSession() as session:
+            rows = await session.execute(
+                select(PersistentData.key, PersistentData.data).filter_by(kind=kind)
+            )
+            return {key: pickle.loads(data) for key, data in rows}
+
+    def _mark(self, kind, key, value):
+        # Сериализуем сразу: к моменту записи объект может измениться
+        self._dirty[(kind, str(key))] = None if value is None else pickle.dumps(value)
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._delayed_write())
+
+    async def _delayed_write(self):
+        # Даём PTB передать все изменения текущего цикла, чтобы записать их разом
+        await asyncio.sleep(self.write_delay)
+        await self._write()
+
+    async def _write(self):
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            now = datetime.now()
+            try:
+                async with AsyncSession() as session:
+                    await session.execute(
+                        delete(PersistentData).where(
+                            tuple_(PersistentData.kind, PersistentData.key).in_(list(dirty))
+                        )
+                    )
+                    rows = [
+                        {'kind': kind, 'key': key, 'data': data, 'updated_at': now}
+                        for (kind, key), data in dirty.items() if data is not None
+                    ]
+                    if rows:
+                        await session.execute(insert(PersistentData), rows)
+                    await session.commit()
+            except Exception:
+                # Вернём несохранённое в буфер, если его ещё не перезаписали свежим
+                logger.exception("Не удалось сохранить состояние бота")
+                for item, data in dirty.items():
+                    self._dirty.setdefault(item, data)
+
+    async def get_user_data(self):
+        return {int(key): data for key, data in (await self._load(USER_DATA)).items()}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in (await self._load(CHAT_DATA)).items()}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        states = await self._load(CONVERSATION + name)
+        return {tuple(json.loads(key)): state for key, state in states.items()}
+
+    async def update_user_data(self, user_id, data):
+        self._mark(USER_DATA, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark(CHAT_DATA, chat_id, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        # None — диалог завершён, запись удаляем
+        self._mark(CONVERSATION + name, json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._mark(USER_DATA, user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark(CHAT_DATA, chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Записывает всё накопленное; PTB вызывает при остановке."""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write()
@@ -0,0 +1,545 @@
+"""Пути доступа к данным для обработчиков бота.
+
+Каждый запрос здесь опирается на один из составных индексов, объявленных
+в database.py, поэтому экраны «Доступные задания» и «Мои задания»
+не приводят к полному просмотру таблицы tasks.
+"""
+from collections import namedtuple, Counter
+import re
+from sqlalchemy import select, update, delete, insert, or_, tuple_, event, text, table, column
+from sqlalchemy.orm import joinedload
+from database import (
+    AsyncSession, User, Task, ArchivedTask, Attachment, func, search_enabled, task_history,
+    TeacherSubjectStats, TeacherHelperStats, TeacherCompletionHistogram,
+    STATUS_COLUMNS, completion_bucket, increment,
+)
+from cache import TTLCache
+from matching import best_match
+from attachments import AttachmentInfo
+
+# Размер страницы для списков заданий
+PAGE_SIZE = 5
+
+# Ключи сортировки для keyset-пагинации
+OPEN_TASKS_KEYS = (Task.id,)
+MY_TASKS_KEYS = (Task.status, Task.id)
+ARCHIVE_KEYS = (ArchivedTask.id,)
+
+
+def encode_cursor(values):
+    """Курсор для callback_data: значения ключа через точку."""
+    return ".".join(str(v) for v in values)
+
+
+def decode_cursor(text):
+    return tuple(int(v) if v.isdigit() else v for v in text.split("."))
+
+
+async def fetch_page(session, stmt, keys, after=None, before=None, limit=PAGE_SIZE):
+    """Страница по ключу keys после курсора after или перед курсором before.
+
+    Возвращает (rows, has_prev, has_next). Запрос всегда ограничен LIMIT,
+    поэтому стоимость страницы не зависит от размера таблицы.
+    """
+    if before is not None:
+        stmt = stmt.where(tuple_(*keys) < tuple_(*before))\
+                   .order_by(*[key.desc() for key in keys])
+    else:
+        if after is not None:
+            stmt = stmt.where(tuple_(*keys) > tuple_(*after))
+        stmt = stmt.order_by(*keys)
+
+    rows = list((await session.scalars(stmt.limit(limit + 1))).all())
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+        return rows, more, True
+    return rows, after is not None, more
+
+
+# Личность пользователя для проверки роли и отрисовки меню без обращения к БД
+Identity = namedtuple('Identity', ['id', 'user_type', 'full_name'])
+identity_cache = TTLCache(maxsize=10000, ttl=600)
+
+
+def remember_identity(user):
+    identity = Identity(user.id, user.user_type, user.full_name)
+    identity_cache.set(user.chat_id, identity)
+    return identity
+
+
+async def get_identity(chat_id, user_type=None):
+    """Identity по chat_id из кэша; в БД идём только при промахе."""
+    identity = identity_cache.get(chat_id)
+    if identity is None:
+        async with AsyncSession() as session:
+            user = await get_user(session, chat_id)
+        if not user:
+            return None
+        identity = remember_identity(user)
+    if user_type and identity.user_type != user_type:
+        return None
+    return identity
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _forget_identity(mapper, connection, user):
+    identity_cache.invalidate(user.chat_id)
+
+
+async def get_user(session, chat_id, user_type=None):
+    """Пользователь по chat_id (уникальный индекс), опционально с проверкой роли."""
+    user = await session.scalar(select(User).filter_by(chat_id=chat_id))
+    if user and user_type and user.user_type != user_type:
+        return None
+    return user
+
+
+async def get_task(session, task_id, *relations):
+    """Задание по первичному ключу с жадной загрузкой указанных связей."""
+    return await session.get(
+        Task, task_id,
+        options=[joinedload(rel) for rel in relations]
+    )
+
+
+# Вложения после сохранения не меняются, поэтому кэш сбрасывается только при удалении
+attachment_cache = TTLCache(maxsize=5000, ttl=3600)
+
+ATTACHMENT_COLUMNS = (
+    Attachment.task_id, Attachment.media_type, Attachment.file_id,
+    Attachment.file_unique_id, Attachment.file_size, Attachment.file_name,
+)
+
+
+def legacy_attachments(task, role='task'):
+    """Вложение из старых колонок задания, ещё не перенесённое миграцией 8."""
+    if role == 'task' and task.attachment_id:
+        # До таблицы attachments фото отмечали именем 'фото'
+        if task.attachment_name == 'фото':
+            return [AttachmentInfo('photo', task.attachment_id, None, None, None)]
+        return [AttachmentInfo('document', task.attachment_id, None, None, task.attachment_name)]
+    if role == 'solution' and task.solution_file_id:
+        return [AttachmentInfo('document', task.solution_file_id, None, None, None)]
+    return []
+
+
+async def attachments_by_task(session, tasks, role='task'):
+    """{task.id: [AttachmentInfo, ...]} для нескольких заданий; задания без файлов — пустой список."""
+    found, missing = {}, []
+    for task in tasks:
+        cached = attachment_cache.get((task.id, role))
+        if cached is None:
+            missing.append(task.id)
+        else:
+            found[task.id] = cached
+    if missing:
+        loaded = {task_id: [] for task_id in missing}
+        # ix_attachments_task_role: (task_id, role, position)
+        for task_id, *info in await session.execute(
+            select(*ATTACHMENT_COLUMNS)
+                .where(Attachment.task_id.in_(missing), Attachment.role == role)
+                .order_by(Attachment.task_id, Attachment.position)
+        ):
+            loaded[task_id].append(AttachmentInfo(*info))
+        for task_id, items in loaded.items():
+            attachment_cache.set((task_id, role), items)
+        found.update(loaded)
+    return {task.id: found[task.id] or legacy_attachments(task, role) for task in tasks}
+
+
+async def get_attachments(session, task, role='task'):
+    return (await attachments_by_task(session, [task], role))[task.id]
+
+
+async def save_attachments(session, task_id, role, items):
+    """Сохраняет вложения одним INSERT (executemany) в порядке items."""
+    if not items:
+        return
+    await session.execute(insert(Attachment), [
+        {'task_id': task_id, 'role': role, 'position': position, **item._asdict()}
+        for position, item in enumerate(items)
+    ])
+    attachment_cache.invalidate((task_id, role))
+
+
+async def delete_attachments(session, task_id):
+    await session.execute(delete(Attachment).where(Attachment.task_id == task_id))
+    for role in ('task', 'solution'):
+        attachment_cache.invalidate((task_id, role))
+
+
+async def page_open_tasks(session, subject_id=None, after=None, before=None, limit=PAGE_SIZE):
+    # ix_tasks_status_id / ix_tasks_status_subject отдают строки уже в порядке id
+    stmt = select(Task).filter_by(status='new')
+    if subject_id is not None:
+        stmt = stmt.filter_by(subject_id=subject_id)
+    return await fetch_page(session, stmt, OPEN_TASKS_KEYS, after, before, limit)
+
+
+tasks_fts = table('tasks_fts', column('rowid'))
+
+
+def search_terms(words):
+    """Слова запроса без операторов FTS5; не больше 8 штук."""
+    return re.findall(r'\w+', words.lower().replace('ё', 'е'))[:8]
+
+
+async def search_open_tasks(session, words, offset=0, limit=PAGE_SIZE):
+    """Открытые задания, подходящие под все слова запроса, по убыванию релевантности.
+
+    Поиск идёт по индексу FTS5 tasks_fts (совпадение в заголовке весит больше,
+    чем в описании), каждое слово ищется как префикс. Без SQLite — запасной
+    вариант через LIKE. Возвращает (rows, has_more).
+    """
+    terms = search_terms(words)
+    if not terms:
+        return [], False
+    if search_enabled():
+        stmt = select(Task)\
+            .join(tasks_fts, tasks_fts.c.rowid == Task.id)\
+            .where(text("tasks_fts MATCH :match"), Task.status == 'new')\
+            .order_by(text("bm25(tasks_fts, 10.0, 1.0)"), Task.id)\
+            .params(match=" ".join(f'"{term}"*' for term in terms))
+    else:
+        stmt = select(Task).filter_by(status='new').order_by(Task.id)
+        for term in terms:
+            stmt = stmt.where(or_(Task.title.ilike(f"%{term}%"), Task.description.ilike(f"%{term}%")))
+    rows = list((await session.scalars(stmt.offset(offset).limit(limit + 1))).all())
+    return rows[:limit], len(rows) > limit
+
+
+async def count_open_tasks_by_subject(session):
+    """{subject_id: число новых заданий} одним GROUP BY по ix_tasks_status_subject.
+
+    Названия предметов берутся из subjects.subject_registry, без JOIN.
+    """
+    rows = await session.execute(
+        select(Task.subject_id, func.count())
+            .filter_by(status='new')
+            .group_by(Task.subject_id)
+    )
+    return dict(rows.all())
+
+
+async def page_student_tasks(session, student_id, after=None, before=None):
+    # ix_tasks_student_status_id: (student_id, status, id) — порядок MY_TASKS_KEYS
+    stmt = select(Task)\
+        .options(joinedload(Task.subject), joinedload(Task.helper))\
+        .filter_by(student_id=student_id)
+    return await fetch_page(session, stmt, MY_TASKS_KEYS, after, before)
+
+
+async def page_helper_tasks(session, helper_id, after=None, before=None):
+    # ix_tasks_helper_status: (helper_id, status)
+    stmt = select(Task).filter_by(helper_id=helper_id)
+    return await fetch_page(session, stmt, MY_TASKS_KEYS, after, before)
+
+
+async def page_archived_tasks(session, user_type, user_id, after=None, before=None):
+    # ix_tasks_archive_student / ix_tasks_archive_helper: (student_id|helper_id, id)
+    stmt = select(ArchivedTask)
+    if user_type == 'helper':
+        stmt = stmt.filter_by(helper_id=user_id)
+    else:
+        stmt = stmt.options(joinedload(ArchivedTask.helper)).filter_by(student_id=user_id)
+    return await fetch_page(session, stmt, ARCHIVE_KEYS, after, before)
+
+
+async def claim_task(session, task_id, helper_id):
+    """Атомарно закрепляет новое задание за помощником.
+
+    Один UPDATE ... WHERE id=? AND status='new': из двух конкурирующих
+    помощников строку изменит только первый. Возвращает True, если
+    задание досталось этому помощнику.
+    """
+    row = (await session.execute(
+        update(Task)
+            .where(Task.id == task_id, Task.status == 'new')
+            .values(status='in_progress', helper_id=helper_id)
+            .returning(Task.teacher_id, Task.subject_id)
+            .execution_options(synchronize_session=False)
+    )).first()
+    if row is None:
+        return False
+    await count_transition(session, row.teacher_id, row.subject_id, 'new', 'in_progress')
+    return True
+
+
+async def release_task(session, task_id, helper_id):
+    """Возвращает взятое задание в общий список, если его исполнитель — helper_id.
+
+    Условие status='in_progress' в UPDATE не даёт «отказаться» от уже
+    завершённого задания. Возвращает True, если задание освобождено.
+    """
+    row = (await session.execute(
+        update(Task)
+            .where(Task.id == task_id, Task.helper_id == helper_id, Task.status == 'in_progress')
+            .values(status='new', helper_id=None)
+            .returning(Task.teacher_id, Task.subject_id)
+            .execution_options(synchronize_session=False)
+    )).first()
+    if row is None:
+        return False
+    await count_transition(session, row.teacher_id, row.subject_id, 'in_progress', 'new')
+    return True
+
+
+async def complete_task(session, task_id, helper_id, solution_text, completed_at):
+    """Атомарно завершает задание помощника и обновляет сводки и счётчик помощника.
+
+    Повторная отправка решения (второй /done, двойное нажатие) UPDATE с
+    условием status='in_progress' не пройдёт, и завершение не засчитается
+    дважды. Возвращает True, если задание завершил этот вызов.
+    """
+    row = (await session.execute(
+        update(Task)
+            .where(Task.id == task_id, Task.helper_id == helper_id, Task.status == 'in_progress')
+            .values(status='completed', completed_at=completed_at, solution_text=solution_text)
+            .returning(Task.teacher_id, Task.subject_id, Task.helper_id, Task.created_at)
+            .execution_options(synchronize_session=False)
+    )).first()
+    if row is None:
+        return False
+    await record_completion(session, row, completed_at)
+    await increment_completed_tasks(session, helper_id)
+    return True
+
+
+async def record_rating(session, task_id, rating):
+    """Ставит оценку завершённому заданию и обновляет агрегат помощника.
+
+    Оба UPDATE выполняются в транзакции вызывающего кода, стоимость не
+    зависит от числа заданий помощника. Возвращает False, если задание
+    не завершено или уже оценено.
+    """
+    result = await session.execute(
+        update(Task)
+            .where(Task.id == task_id, Task.status == 'completed', Task.rating.is_(None))
+            .values(rating=rating)
+            .returning(Task.helper_id, Task.teacher_id, Task.subject_id)
+            .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+    if row is None:
+        return False
+    if row.teacher_id is not None:
+        await session.execute(increment(
+            TeacherSubjectStats, {'teacher_id': row.teacher_id, 'subject_id': row.subject_id},
+            rating_sum=rating, rating_count=1
+        ))
+        if row.helper_id is not None:
+            await session.execute(increment(
+                TeacherHelperStats, {'teacher_id': row.teacher_id, 'helper_id': row.helper_id},
+                rating_sum=rating, rating_count=1
+            ))
+    if row.helper_id is not None:
+        # В SET справа стоят старые значения колонок
+        await session.execute(
+            update(User)
+                .where(User.id == row.helper_id)
+                .values(
+                    rating_sum=User.rating_sum + rating,
+                    rating_count=User.rating_count + 1,
+                    rating=(User.rating_sum + rating) * 1.0 / (User.rating_count + 1)
+                )
+                .execution_options(synchronize_session=False)
+        )
+    return True
+
+
+async def count_transition(session, teacher_id, subject_id, old=None, new=None, count=1):
+    """Переносит count заданий из счётчика статуса old в new в сводке преподавателя.
+
+    old=None — задание создано, new=None — удалено. Вызывается в той же
+    транзакции, что и сама смена статуса.
+    """
+    if teacher_id is None:
+        return
+    deltas = Counter()
+    if old is not None:
+        deltas[STATUS_COLUMNS[old]] -= count
+    if new is not None:
+        deltas[STATUS_COLUMNS[new]] += count
+    await session.execute(increment(
+        TeacherSubjectStats, {'teacher_id': teacher_id, 'subject_id': subject_id}, **deltas
+    ))
+
+
+async def record_completion(session, task, completed_at):
+    """Сводки преподавателя для задания, которое помощник только что завершил."""
+    if task.teacher_id is None:
+        return
+    await count_transition(session, task.teacher_id, task.subject_id, 'in_progress', 'completed')
+    await session.execute(increment(
+        TeacherHelperStats, {'teacher_id': task.teacher_id, 'helper_id': task.helper_id}, completed_tasks=1
+    ))
+    await session.execute(increment(
+        TeacherCompletionHistogram,
+        {'teacher_id': task.teacher_id, 'bucket': completion_bucket(task.created_at, completed_at)},
+        tasks=1
+    ))
+
+
+async def increment_completed_tasks(session, helper_id):
+    # UPDATE без предварительной загрузки помощника в сессию
+    await session.execute(
+        update(User)
+            .where(User.id == helper_id)
+            .values(completed_tasks=User.completed_tasks + 1)
+    )
+
+
+async def due_for_reminder(session, start, until, limit):
+    """Активные задания с дедлайном в [start, until), по которым ещё не напоминали.
+
+    Диапазон по ix_tasks_status_deadline; LIMIT ограничивает пачку за один тик.
+    """
+    return (await session.scalars(
+        select(Task)
+            .options(joinedload(Task.student), joinedload(Task.helper))
+            .where(
+                Task.status.in_(('new', 'in_progress')),
+                Task.deadline >= start,
+                Task.deadline < until,
+                Task.reminded_at.is_(None),
+            )
+            .order_by(Task.deadline)
+            .limit(limit)
+    )).all()
+
+
+async def mark_reminded(session, task_ids, when):
+    await session.execute(
+        update(Task)
+            .where(Task.id.in_(task_ids))
+            .values(reminded_at=when)
+            .execution_options(synchronize_session=False)
+    )
+
+
+async def expire_overdue(session, before, limit):
+    """Переводит не взятые задания с дедлайном раньше before в 'expired'.
+
+    Условие status='new' в самом UPDATE защищает от гонки с claim_task.
+    Возвращает список (id, title, chat_id студента) истёкших заданий.
+    """
+    candidates = (await session.scalars(
+        select(Task.id)
+            .where(Task.status == 'new', Task.deadline < before)
+            .order_by(Task.deadline)
+            .limit(limit)
+    )).all()
+    if not candidates:
+        return []
+    expired = (await session.execute(
+        update(Task)
+            .where(Task.id.in_(candidates), Task.status == 'new')
+            .values(status='expired')
+            .returning(Task.id, Task.teacher_id, Task.subject_id)
+            .execution_options(synchronize_session=False)
+    )).all()
+    if not expired:
+        return []
+    # Один UPSERT на пару (преподаватель, предмет), а не на задание
+    groups = Counter((row.teacher_id, row.subject_id) for row in expired)
+    for (teacher_id, subject_id), count in groups.items():
+        await count_transition(session, teacher_id, subject_id, 'new', 'expired', count)
+    expired = [row.id for row in expired]
+    rows = await session.execute(
+        select(Task.id, Task.title, User.chat_id)
+            .join(User, User.id == Task.student_id)
+            .where(Task.id.in_(expired))
+    )
+    return rows.all()
+
+
+async def resolve_teacher(session, teacher_name):
+    """id зарегистрированного преподавателя, наиболее похожего на введённое имя."""
+    teachers = (await session.execute(
+        select(User.id, User.full_name).filter_by(user_type='teacher')
+    )).all()
+    return best_match(teacher_name, teachers)
+
+
+async def teacher_tasks(session, teacher_id):
+    # ix_tasks_teacher_created: (teacher_id, created_at)
+    return (await session.scalars(
+        select(Task)
+            .options(joinedload(Task.subject), joinedload(Task.student), joinedload(Task.helper))
+            .filter_by(teacher_id=teacher_id)
+            .order_by(Task.created_at)
+    )).all()
+
+
+async def teacher_students(session, teacher_id):
+    # Включая студентов, чьи задания уже в архиве
+    history = task_history('student_id', 'teacher_id').c
+    return (await session.scalars(
+        select(User)
+            .where(User.id.in_(select(history.student_id).where(history.teacher_id == teacher_id)))
+    )).all()
+
+
+async def teacher_helpers(session, teacher_id):
+    # Сводка teacher_helper_stats уже учитывает и архивные задания
+    return (await session.scalars(
+        select(User)
+            .join(TeacherHelperStats, TeacherHelperStats.helper_id == User.id)
+            .filter(TeacherHelperStats.teacher_id == teacher_id, TeacherHelperStats.completed_tasks > 0)
+    )).all()
+
+
+TeacherDashboard = namedtuple('TeacherDashboard', ['subjects', 'helpers', 'histogram'])
+
+
+async def teacher_dashboard(session, teacher_id, top=5):
+    """Сводки преподавателя: строки по предметам, топ помощников и гистограмма.
+
+    Все три выборки идут по первичным ключам сводных таблиц (teacher_id, ...)
+    и не зависят от числа заданий.
+    """
+    subjects = (await session.scalars(
+        select(TeacherSubjectStats).filter_by(teacher_id=teacher_id)
+    )).all()
+    helpers = (await session.execute(
+        select(User.full_name, TeacherHelperStats.completed_tasks,
+               TeacherHelperStats.rating_sum, TeacherHelperStats.rating_count)
+            .join(User, User.id == TeacherHelperStats.helper_id)
+            .where(TeacherHelperStats.teacher_id == teacher_id, TeacherHelperStats.completed_tasks > 0)
+            .order_by(TeacherHelperStats.completed_tasks.desc(), TeacherHelperStats.rating_sum.desc())
+            .limit(top)
+    )).all()
+    histogram = dict((await session.execute(
+        select(TeacherCompletionHistogram.bucket, TeacherCompletionHistogram.tasks)
+            .filter_by(teacher_id=teacher_id)
+    )).all())
+    return TeacherDashboard(subjects, helpers, histogram)
+
+
+async def top_helpers(session, limit):
+    # ix_users_type_rating: (user_type, rating)
+    return (await session.scalars(
+        select(User)
+            .filter_by(user_type='helper')
+            .order_by(User.rating.desc(), User.id)
+            .limit(limit)
+    )).all()
+
+
+async def helper_position(session, helper_id):
+    """Место помощника в рейтинге и общее число помощников (по индексу, без выборки строк)."""
+    rating = await session.scalar(select(User.rating).filter_by(id=helper_id))
+    if rating is None:
+        return None, 0
+    above = await session.scalar(
+        select(func.count()).select_from(User)
+            .filter_by(user_type='helper')
+            .filter(User.rating > rating)
+    )
+    total = await session.scalar(
+        select(func.count()).select_from(User).filter_by(user_type='helper')
+    )
+    return above + 1, total
@@ -0,0 +1,122 @@
+"""Готовые тексты и клавиатуры для экранов бота.
+
+Статичные меню собираются один раз при импорте, клавиатуры выбора
+предмета — по одной на набор предметов. Карточки заданий кэшируются
+по (id, updated_at): любое изменение задания (смена статуса, оценка)
+меняет updated_at, и карточка перерисовывается при следующем показе.
+"""
+from functools import lru_cache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from cache import TTLCache
+
+ROLE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Студент", callback_data='student')],
+    [InlineKeyboardButton("Помогающий студент", callback_data='helper')],
+    [InlineKeyboardButton("Преподаватель", callback_data='teacher')],
+])
+
+STUDENT_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Создать задание", callback_data='create_task')],
+    [InlineKeyboardButton("📋 Мои задания", callback_data='my_tasks')],
+    [InlineKeyboardButton("🏆 Рейтинг помощников", callback_data='helper_rating')],
+])
+
+HELPER_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Мои задания", callback_data='helper_my_tasks')],
+    [InlineKeyboardButton("🔍 Доступные задания", callback_data='available_tasks')],
+    [InlineKeyboardButton("🏆 Рейтинг помощников", callback_data='helper_rating')],
+])
+
+TEACHER_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Задания моих студентов", callback_data='teacher_student_tasks')],
+    [InlineKeyboardButton("👨‍🎓 Студенты, загрузившие задания", callback_data='teacher_students')],
+    [InlineKeyboardButton("👨‍🏫 Помогающие студенты по моим заданиям", callback_data='teacher_helpers')],
+    [InlineKeyboardButton("📊 Статистика", callback_data='teacher_dashboard')],
+    [InlineKeyboardButton("📥 Выгрузить задания (CSV)", callback_data='teacher_export')],
+])
+
+# Кнопка «В меню» для каждой роли
+BACK_BUTTONS = {
+    role: InlineKeyboardButton("🔙 В меню", callback_data=f'back_to_{role}_menu')
+    for role in ('student', 'helper', 'teacher')
+}
+BACK_KEYBOARDS = {role: InlineKeyboardMarkup([[button]]) for role, button in BACK_BUTTONS.items()}
+
+ARCHIVE_BUTTON = InlineKeyboardButton("📦 Архив", callback_data='archive')
+
+STATUS_ICONS = {
+    'new': '🆕',
+    'in_progress': '🔄',
+    'completed': '✅',
+    'expired': '⌛',
+}
+
+
+@lru_cache(maxsize=32)
+def _subject_keyboard(subjects):
+    keyboard = [[InlineKeyboardButton(name, callback_data=f"subj_{subject_id}")] for subject_id, name in subjects]
+    keyboard.append([InlineKeyboardButton("➕ Добавить новый предмет", callback_data="new_subject")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def subject_keyboard(subjects):
+    """Клавиатура выбора предмета; одна и та же для одинакового списка предметов."""
+    return _subject_keyboard(tuple((subject.id, subject.name) for subject in subjects))
+
+
+# (вид карточки, id задания) -> (updated_at, карточка)
+_cards = TTLCache(maxsize=5000, ttl=3600)
+
+
+def _cached_card(kind, task, build):
+    entry = _cards.get((kind, task.id))
+    if entry is not None and entry[0] == task.updated_at:
+        return entry[1]
+    card = build(task)
+    _cards.set((kind, task.id), (task.updated_at, card))
+    return card
+
+
+def _student_card(task):
+    lines = [
+        f"{STATUS_ICONS[task.status]} <b>{task.title}</b>",
+        f"📝 Описание: {task.description[:50]}…",
+        f"🏷 Предмет: {task.subject.name}",
+        f"👨‍🏫 Преподаватель: {task.teacher_name}",
+        f"📅 Создано: {task.created_at.strftime('%d.%m.%Y %H:%M')}",
+        f"⏰ Срок: {task.deadline.strftime('%d.%m.%Y')}",
+        f"🔄 Статус: {task.status}"
+    ]
+    if task.helper:
+        lines.append(f"👨‍🎓 Помощник: {task.helper.full_name}")
+
+    # Кнопка «Удалить» или «Оценить»
+    button = None
+    if task.status in ('new', 'expired'):
+        button = InlineKeyboardButton(f"❌ Удалить '{task.title[:15]}…'", callback_data=f"delete_task_{task.id}")
+    elif task.status == 'completed' and not task.rating:
+        button = InlineKeyboardButton(f"⭐ Оценить '{task.title[:15]}…'", callback_data=f"rate_task_{task.id}")
+    return "\n".join(lines), button
+
+
+def student_task_card(task):
+    """Текст карточки в «Моих заданиях» студента и кнопка действия (или None).
+
+    Нужны загруженные task.subject и task.helper.
+    """
+    return _cached_card('student', task, _student_card)
+
+
+def _open_card(task):
+    # Обрезаем описание, чтобы страница уложилась в лимит сообщения Telegram
+    description = task.description if len(task.description) <= 300 else task.description[:300] + "…"
+    return (
+        f"<b>{task.title}</b>\n"
+        f"{description}\n"
+        f"⏰ Дедлайн: {task.deadline.strftime('%d.%m.%Y')}\n"
+    )
+
+
+def open_task_card(task):
+    """Карточка задания в списке доступных (без порядкового номера)."""
+    return _cached_card('open', task, _open_card)
@@ -0,0 +1,91 @@
+"""Справочник предметов в памяти бота.
+
+Предметов немного, а нужны они почти на каждом экране создания и поиска
+заданий, поэтому список загружается один раз (и перечитывается раз в
+max_age секунд), а новые предметы добавляются в него сразу после INSERT.
+Введённое вручную название сначала сравнивается с существующими с точностью
+до регистра, пунктуации и опечатки в одну букву (matching.spelling_similarity),
+так что «матан.» и «Матан» — один предмет, а «Физика 1» и «Физика 2» — разные.
+"""
+import asyncio
+import time
+from collections import namedtuple
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from database import AsyncSession, Subject
+from matching import best_match, spelling_similarity
+
+SubjectEntry = namedtuple('SubjectEntry', ['id', 'name'])
+
+
+class SubjectRegistry:
+    def __init__(self, max_age=600):
+        self.max_age = max_age
+        self._entries = None        # отсортированы по названию
+        self._by_id = {}
+        self._loaded_at = 0.0
+        self._load_lock = asyncio.Lock()
+        self._insert_lock = asyncio.Lock()
+
+    def _set(self, entries):
+        self._entries = sorted(entries, key=lambda entry: entry.name)
+        self._by_id = {entry.id: entry for entry in self._entries}
+        self._loaded_at = time.monotonic()
+
+    def _stale(self):
+        return self._entries is None or time.monotonic() - self._loaded_at > self.max_age
+
+    async def load(self):
+        async with AsyncSession() as session:
+            rows = await session.execute(select(Subject.id, Subject.name))
+            self._set([SubjectEntry(*row) for row in rows])
+
+    async def _ensure(self):
+        if self._stale():
+            async with self._load_lock:
+                if self._stale():
+                    await self.load()
+
+    def invalidate(self):
+        self._entries = None
+
+    async def all(self):
+        await self._ensure()
+        return self._entries
+
+    async def get(self, subject_id):
+        await self._ensure()
+        return self._by_id.get(subject_id)
+
+    def _match(self, name):
+        return best_match(name, ((entry, entry.name) for entry in self._entries), scorer=spelling_similarity)
+
+    async def resolve(self, name):
+        """Существующий похожий предмет или новый, созданный с этим названием."""
+        name = " ".join(name.split())
+        await self._ensure()
+        entry = self._match(name)
+        if entry:
+            return entry
+
+        # Добавляем по одному, чтобы два одинаковых названия не создали два предмета
+        async with self._insert_lock:
+            entry = self._match(name)
+            if entry:
+                return entry
+            async with AsyncSession() as session:
+                subject = Subject(name=name)
+                session.add(subject)
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    # Такой предмет уже добавлен в обход кэша
+                    await session.rollback()
+                    subject = await session.scalar(select(Subject).filter_by(name=name))
+            entry = SubjectEntry(subject.id, subject.name)
+            if self._entries is not None:
+                self._set(self._entries + [entry])
+            return entry
+
+
+subject_registry = SubjectRegistry()
@@ -0,0 +1,186 @@
+"""Потоковый экспорт и импорт таблиц в CSV и Parquet.
+
+Экспорт читает строки пачками через yield_per (на стороне сервера, где
+СУБД это умеет), импорт вставляет их пачками одним INSERT с executemany,
+поэтому память не зависит от размера таблицы. Для Parquet нужен pyarrow
+(pip install pyarrow), для CSV — только стандартная библиотека. CSV пишется
+в UTF-8 с BOM, чтобы Excel правильно открывал кириллицу.
+"""
+import csv
+from datetime import datetime
+from sqlalchemy import select, insert, union_all, DateTime, Float, Integer, LargeBinary
+from database import (
+    engine, User, Subject, Task, ArchivedTask, Attachment, rebuild_teacher_stats, rebuild_rating_aggregates,
+)
+
+# Порядок важен для импорта: задания ссылаются на пользователей и предметы
+TABLES = {
+    'subjects': Subject,
+    'users': User,
+    'tasks': Task,
+    'archive': ArchivedTask,
+    'attachments': Attachment,
+}
+
+BATCH_SIZE = 10_000
+
+
+def detect_format(path):
+    return 'parquet' if path.endswith(('.parquet', '.pq')) else 'csv'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet requires pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def _arrow_type(pa, column_type):
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, LargeBinary):
+        return pa.binary()
+    return pa.string()
+
+
+def _write_csv(path, names, partitions):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        for rows in partitions:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_parquet(path, columns, partitions):
+    pa = _pyarrow()
+    schema = pa.schema([(column.name, _arrow_type(pa, column.type)) for column in columns])
+    count = 0
+    with pa.parquet.ParquetWriter(path, schema) as writer:
+        for rows in partitions:
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                schema=schema
+            ))
+            count += len(rows)
+    return count
+
+
+def export_rows(stmt, path, fmt=None, batch_size=BATCH_SIZE):
+    """Выгружает результат select в файл, не держа в памяти больше одной пачки строк.
+
+    Колонки файла — колонки запроса (с их label). Возвращает число строк.
+    """
+    fmt = fmt or detect_format(path)
+    columns = list(stmt.selected_columns)
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(stmt)
+        partitions = result.partitions()
+        if fmt == 'parquet':
+            return _write_parquet(path, columns, partitions)
+        return _write_csv(path, [column.name for column in columns], partitions)
+
+
+def export_table(name, path, fmt=None, batch_size=BATCH_SIZE):
+    table = TABLES[name].__table__
+    stmt = select(*table.columns).order_by(*table.primary_key.columns)
+    return export_rows(stmt, path, fmt, batch_size)
+
+
+def _csv_converter(column):
+    # В CSV всё строки: пустая строка означает NULL, кроме обязательных текстовых полей
+    if isinstance(column.type, Integer):
+        parse = int
+    elif isinstance(column.type, Float):
+        parse = float
+    elif isinstance(column.type, DateTime):
+        parse = datetime.fromisoformat
+    else:
+        return (lambda value: value or None) if column.nullable else (lambda value: value)
+    return lambda value: parse(value) if value != '' else None
+
+
+def _read_csv(path, table, batch_size):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        names = next(reader, None) or []
+        _check_columns(table, names)
+        converters = [_csv_converter(table.columns[name]) for name in names]
+        batch = []
+        for values in reader:
+            batch.append({name: convert(value) for name, convert, value in zip(names, converters, values)})
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _read_parquet(path, table, batch_size):
+    pa = _pyarrow()
+    parquet = pa.parquet.ParquetFile(path)
+    _check_columns(table, parquet.schema_arrow.names)
+    for record_batch in parquet.iter_batches(batch_size=batch_size):
+        yield record_batch.to_pylist()
+
+
+def _check_columns(table, names):
+    unknown = [name for name in names if name not in table.columns]
+    if unknown:
+        raise ValueError(f"Unknown columns for table {table.name}: {', '.join(unknown)}")
+
+
+def import_table(name, path, fmt=None, batch_size=BATCH_SIZE):
+    """Загружает строки из файла в таблицу пачками по batch_size. Возвращает число строк.
+
+    id из файла сохраняются, поэтому связанные таблицы импортируются в
+    порядке TABLES. Всё выполняется в одной транзакции.
+    """
+    fmt = fmt or detect_format(path)
+    table = TABLES[name].__table__
+    batches = _read_parquet(path, table, batch_size) if fmt == 'parquet' else _read_csv(path, table, batch_size)
+    count = 0
+    with engine.begin() as conn:
+        for batch in batches:
+            conn.execute(insert(table), batch)
+            count += len(batch)
+    # Сводки преподавателей и рейтинги помощников не видят массовую вставку,
+    # пересчитываем их целиком
+    if name in ('tasks', 'archive') and count:
+        rebuild_teacher_stats()
+        rebuild_rating_aggregates()
+    return count
+
+
+def teacher_tasks_export(teacher_id):
+    """Задания преподавателя (вместе с архивом) с именами вместо id — для выгрузки из бота."""
+    student = User.__table__.alias('student')
+    helper = User.__table__.alias('helper')
+    selects = []
+    for model in (Task, ArchivedTask):
+        selects.append(
+            select(
+                # Явные имена: ORDER BY у UNION ссылается на колонку результата
+                *(getattr(model, name).label(name) for name in ('id', 'title', 'description', 'status')),
+                Subject.name.label('subject'),
+                student.c.full_name.label('student'),
+                student.c.group_name.label('student_group'),
+                helper.c.full_name.label('helper'),
+                *(getattr(model, name).label(name) for name in ('created_at', 'deadline', 'completed_at', 'rating')),
+            )
+                .join(Subject, Subject.id == model.subject_id)
+                .join(student, student.c.id == model.student_id)
+                .outerjoin(helper, helper.c.id == model.helper_id)
+                .where(model.teacher_id == teacher_id)
+        )
+    stmt = union_all(*selects)
+    return stmt.order_by(stmt.selected_columns.created_at)